@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark of the WeatherLink poll path.
+Copyright (c) 2020 Robert Paauwe
+
+Starts the local WeatherLink stand-in, points a controller at it and
+times each stage of a poll:
+
+    fetch     - HTTP request and response body
+    decode    - JSON decode of the body (orjson when installed)
+    current   - current conditions parse and publish (controller)
+    extract   - day/month/year extraction
+    day, month, year - driver publish for each period node
+    get_data  - complete poll, all stations
+
+    python3 bench.py --iterations 200 --stations 4 --latency 0.05
+
+The controller runs in a temporary directory so the benchmark doesn't
+change the extremes, metadata or snapshot files of the node server.
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import statistics
+import polyinterface
+import offline
+import standin
+from nodes import extract
+from nodes import decode
+
+
+class Timings:
+    def __init__(self):
+        self.samples = {}
+        self.order = []
+
+    def add(self, stage, seconds):
+        if stage not in self.samples:
+            self.samples[stage] = []
+            self.order.append(stage)
+        self.samples[stage].append(seconds * 1000.0)
+
+    def report(self, out=None):
+        if out is None:
+            out = sys.stdout
+        out.write('{:<10} {:>6} {:>9} {:>9} {:>9} {:>9}\n'.format(
+            'stage', 'count', 'min ms', 'median', 'p95', 'max'))
+        for stage in self.order:
+            s = sorted(self.samples[stage])
+            p95 = s[min(len(s) - 1, int(len(s) * 0.95))]
+            out.write('{:<10} {:>6} {:>9.3f} {:>9.3f} {:>9.3f} {:>9.3f}\n'.format(
+                stage, len(s), s[0], statistics.median(s), p95, s[-1]))
+
+
+def clear_published(control):
+    for address in control.nodes:
+        control.nodes[address].published = {}
+
+
+"""
+    Time the individual stages for the primary station.
+"""
+def bench_stages(control, timings, iterations, cached):
+    st = control.stations[0]
+    url = st.url(control.api_url())
+
+    for i in range(iterations):
+        if not cached:
+            clear_published(control)
+
+        start = time.perf_counter()
+        c = control.transport.get(url)
+        body = c.content
+        c.close()
+        timings.add('fetch', time.perf_counter() - start)
+
+        start = time.perf_counter()
+        obs = control.decode(body)
+        timings.add('decode', time.perf_counter() - start)
+
+        start = time.perf_counter()
+        control.parse_current_conditions(obs)
+        timings.add('current', time.perf_counter() - start)
+
+        start = time.perf_counter()
+        updates = control.extractor.extract(obs)
+        timings.add('extract', time.perf_counter() - start)
+
+        for period in extract.PERIODS:
+            node = control.nodes[st.address(period)]
+            start = time.perf_counter()
+            node.update_drivers(updates[period])
+            timings.add(period, time.perf_counter() - start)
+
+
+"""
+    Time complete polls of all the stations.
+"""
+def bench_get_data(control, timings, iterations, cached):
+    for i in range(iterations):
+        if not cached:
+            clear_published(control)
+        for st in control.stations:
+            st.schedule.reset()
+
+        start = time.perf_counter()
+        control.get_data()
+        timings.add('get_data', time.perf_counter() - start)
+
+
+def main(argv):
+    # polyinterface sends stdout and stderr to its log when it's
+    # imported, put them back before anything is printed.
+    polyinterface.unload_interface()
+
+    parser = argparse.ArgumentParser(description='WeatherLink poll benchmark')
+    parser.add_argument('--iterations', type=int, default=100)
+    parser.add_argument('--stations', type=int, default=1)
+    parser.add_argument('--latency', type=float, default=0,
+            help='stand-in response latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0)
+    parser.add_argument('--cached', action='store_true',
+            help='keep the last published values between iterations')
+    args = parser.parse_args(argv)
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix='weatherlink-bench-') as workdir:
+        os.chdir(workdir)
+        try:
+            run(args)
+        finally:
+            os.chdir(cwd)
+
+
+def run(args):
+    # synthesize a new observation for every request
+    server = standin.StandIn(latency=args.latency, jitter=args.jitter,
+            interval=1e-6).start()
+
+    stations = ';'.join('bench{0}:pass:token{0}'.format(i) for i in range(1, args.stations))
+    params = {
+            'Device ID': 'bench',
+            'Password': 'pass',
+            'API Token': 'token',
+            'Stations': stations,
+            'API URL': server.url,
+            }
+    (control, iface) = offline.start_controller(params)
+
+    timings = Timings()
+    bench_stages(control, timings, args.iterations, args.cached)
+    iface.reset()
+    bench_get_data(control, timings, args.iterations, args.cached)
+
+    print('{} iterations, {} station(s), {} requests served'.format(
+        args.iterations, args.stations, server.requests))
+    print('{:.1f} driver updates sent per poll'.format(iface.status / args.iterations))
+    print('JSON decoder: {}'.format(decode.BACKEND))
+    timings.report()
+
+    control.stop()
+    server.stop()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
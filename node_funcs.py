@@ -1,6 +1,9 @@
 #
 #  Common functions used by nodes
 
+import os
+import json
+import time
 
 try:
     import polyinterface
@@ -26,15 +29,128 @@ def add_functions_as_methods(functions):
     return decorator
 
 
+"""
+    Deadbands used to suppress driver updates that only differ from the
+    last published value by sensor noise.  Keyed by unit of measure so
+    that the band matches the units the value is in.
+
+    (absolute, relative, wrap)
+       absolute - changes smaller than this are ignored
+       relative - changes smaller than this fraction of the last
+                  published value are ignored
+       wrap     - values wrap around at this value (i.e. 360 for degrees)
+
+    The temperature and pressure bands are one step of the precision
+    the value is shown with, so every change that shows is published.
+    The comparison allows for EPSILON of floating point error in the
+    difference, a change of a whole band is always published.
+
+    A node can override these for specific drivers with a 'deadbands'
+    dictionary keyed by driver, of band tuples or of absolute bands (the
+    wrap of the UOM is kept).  The controller fills it in from the
+    Deadbands parameter.  Values inside the band are still published
+    once the last published value is older than MAX_AGE seconds, or the
+    node's 'max_age' (from the Republish Age parameter).
+"""
+DEADBANDS = {
+        4: (0.1, 0, None),     # temperature C
+        17: (0.1, 0, None),    # temperature F
+        23: (0.003, 0, None),  # pressure inHg
+        117: (0.1, 0, None),   # pressure mb
+        118: (0.01, 0, None),  # pressure kPa
+        76: (5, 0, 360),       # wind direction
+        }
+NO_DEADBAND = (0, 0, None)
+MAX_AGE = 900
+EPSILON = 1e-9
+
+def in_deadband(value, last, band):
+    (absolute, relative, wrap) = band
+    delta = abs(value - last)
+    if wrap is not None:
+        delta = delta % wrap
+        delta = min(delta, wrap - delta)
+    if delta < EPSILON or delta < absolute - EPSILON:
+        return True
+    if relative > 0 and delta < relative * abs(last) - EPSILON:
+        return True
+    return False
+
+# Check the value against the last value published for the driver and
+# return True if it should be sent.
+def should_publish(self, driver, value, uom, force=False):
+    published = getattr(self, 'published', None)
+    if published is None:
+        published = {}
+        self.published = published
+
+    now = time.time()
+    last = published.get(driver)
+    max_age = getattr(self, 'max_age', MAX_AGE)
+    if not force and last is not None and last[1] == uom and (max_age <= 0 or now - last[2] < max_age):
+        band = getattr(self, 'deadbands', {}).get(driver)
+        if band is None:
+            band = DEADBANDS.get(uom, NO_DEADBAND)
+        elif not isinstance(band, tuple):
+            band = (band, 0, DEADBANDS.get(uom, NO_DEADBAND)[2])
+        if in_deadband(value, last[0], band):
+            return False
+
+    published[driver] = (value, uom, now)
+    return True
+
+"""
+    Parse the Deadbands parameter, 'DRIVER=band' entries separated by
+    commas (i.e. 'CLITEMP=0.5, WINDDIR=10').  Changes smaller than the band,
+    in the units the driver is shown in, aren't published.  0 publishes
+    every change.  Returns {driver: band}, invalid entries
+    are logged and skipped.
+"""
+def parse_deadbands(text):
+    bands = {}
+    for entry in (text or '').split(','):
+        entry = entry.strip()
+        if entry == '':
+            continue
+        try:
+            (driver, band) = entry.split('=')
+            band = float(band)
+            if band < 0:
+                raise ValueError(band)
+            bands[driver.strip().upper()] = band
+        except ValueError:
+            LOGGER.warning('Invalid deadband {}, expected DRIVER=band'.format(entry))
+    return bands
+
 # Wrap all the setDriver calls so that we can check that the 
-# value exist first.
+# value exist first.  Nodes with a publisher (see nodes/publish.py) send
+# the update through it so it can be batched.
 def update_driver(self, driver, value, force=False, prec=3):
     try:
-        self.setDriver(driver, round(float(value), prec), True, force, self.uom[driver])
-        LOGGER.debug('setDriver (%s, %f)' %(driver, float(value)))
+        value = round(float(value), prec)
+        metrics = getattr(self, 'metrics', None)
+        if not self.should_publish(driver, value, self.uom[driver], force):
+            if metrics is not None:
+                metrics.inc('driver_updates_suppressed_total')
+            return
+        publisher = getattr(self, 'publisher', None)
+        if publisher is not None:
+            publisher.send(self, driver, value, self.uom[driver], force)
+            LOGGER.debug('update_driver (%s, %f)' %(driver, value))
+            return
+        self.setDriver(driver, value, True, force, self.uom[driver])
+        if metrics is not None:
+            metrics.inc('driver_updates_sent_total')
+        LOGGER.debug('setDriver (%s, %f)' %(driver, value))
     except:
         LOGGER.warning('Missing data for driver ' + driver)
 
+# Apply a list of (driver, value, precision) updates, as produced by
+# the observation extractor.
+def update_drivers(self, updates, force=False):
+    for (driver, value, prec) in updates:
+        self.update_driver(driver, value, force, prec)
+
 def get_saved_log_level(self):
     if 'customData' in self.polyConfig:
         if 'level' in self.polyConfig['customData']:
@@ -71,7 +187,38 @@ def set_logging_level(self, level=None):
     LOGGER.info('set_logging_level: Setting log level to %d' % level)
     LOGGER.setLevel(level)
 
-functions = (update_driver, get_saved_log_level, save_log_level, set_logging_level)
+"""
+    Save text to a file.  The file is written to a temporary file first
+    and then renamed so a crash can't leave a partial file behind.
+"""
+def save_text(path, text):
+    tmp = path + '.tmp'
+    try:
+        with open(tmp, 'w') as f:
+            f.write(text)
+        os.replace(tmp, path)
+    except OSError as e:
+        LOGGER.error('Failed to save {}: {}'.format(path, str(e)))
+
+def save_json(path, data):
+    try:
+        text = json.dumps(data)
+    except (TypeError, ValueError) as e:
+        LOGGER.error('Failed to save {}: {}'.format(path, str(e)))
+        return
+    save_text(path, text)
+
+def load_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        LOGGER.error('Failed to load {}: {}'.format(path, str(e)))
+        return None
+
+functions = (update_driver, update_drivers, should_publish, get_saved_log_level, save_log_level, set_logging_level)
 
 """
     Functions to handle custom parameters.
@@ -95,53 +242,64 @@ functions = (update_driver, get_saved_log_level, save_log_level, set_logging_lev
        self.params.get('param1')
        if self.params.isSet('param1'):
 
+    Parameters are stored in a dictionary keyed by name, and the current
+    value (set value or default) of each is kept in a second dictionary,
+    so get() is a single lookup.
+
+    update_from_polyglot() returns the parameters that changed as a
+    dictionary of name : (old value, new value) so that the node server
+    can apply just those changes.
 """
 
 class NSParameters:
     def __init__(self, parameters):
-        self.internal = []
+        self.internal = {}
+        self.current = {}
 
         for p in parameters:
-            self.internal.append({
+            self.internal[p['name']] = {
                 'name': p['name'],
                 'value': '', 
                 'default': p['default'],
                 'isSet': False,
                 'isRequired': p['isRequired'],
                 'notice_msg': p['notice'],
-                })
+                }
+            self.current[p['name']] = p['default']
 
     def set(self, name, value):
-        for p in self.internal:
-            if p['name'] == name:
-                p['value'] = value
-                p['isSet'] = True
-                return
+        p = self.internal.get(name)
+        if p is None:
+            return
+        p['value'] = value
+        p['isSet'] = True
+        self.current[name] = value
 
     def get(self, name):
-        for p in self.internal:
-            if p['name'] == name:
-                if p['isSet']:
-                    return p['value']
-                else:
-                    return p['default']
+        return self.current.get(name)
 
     def isSet(self, name):
-        for p in self.internal:
-            if p['name'] == name:
-                return p['isSet']
-        return False
+        p = self.internal.get(name)
+        if p is None:
+            return False
+        return p['isSet']
 
     """
         Send notices for unconfigured parameters that are are marked
         as required.
     """
     def send_notices(self, poly):
-        for p in self.internal:
+        for p in self.internal.values():
             if not p['isSet'] and p['isRequired']:
                 if p['notice_msg'] is not None:
                     poly.addNotice(p['notice_msg'], p['name'])
 
+    def valid(self):
+        for p in self.internal.values():
+            if not p['isSet'] and p['isRequired']:
+                return False
+        return True
+
     """
         Read paramenters from Polyglot and update values appropriately.
 
@@ -150,9 +308,8 @@ class NSParameters:
     """
     def get_from_polyglot(self, poly):
         customParams = poly.polyConfig['customParams']
-        params = {}
 
-        for p in self.internal:
+        for p in self.internal.values():
             LOGGER.debug('checking for ' + p['name'] + ' in customParams')
             if p['name'] in customParams:
                 LOGGER.debug('found ' + p['name'] + ' in customParams')
@@ -160,58 +317,46 @@ class NSParameters:
                 if p['value'] != p['default']:
                     LOGGER.debug(p['name'] + ' is now set')
                     p['isSet'] = True
-            
-            if p['isSet']:
-                params[p['name']] = p['value']
-            else:
-                params[p['name']] = p['default']
+                    self.current[p['name']] = p['value']
 
-        poly.addCustomParam(params)            
+        poly.addCustomParam(dict(self.current))
 
-        for p in self.internal:
-            if not p['isSet'] and p['isRequired']:
-                return False
-        return True
+        return self.valid()
 
 
     """
         Called from process_config to check for configuration change
-        We need to know two things; 1) did the configuration change and
-        2) are all required fields filled in.
+        We need to know two things; 1) what changed and 2) are all
+        required fields filled in.
+
+        return (valid, changes) where changes is a dictionary of
+        name : (old value, new value) for each parameter that changed.
+        Setting a parameter back to its default is a change too.
     """
     def update_from_polyglot(self, config):
-        changed = False
-        valid = True
+        changes = {}
 
         if 'customParams' in config:
-            for p in self.internal:
-                if p['name'] in config['customParams']:
-                    poly_param = config['customParams'][p['name']]
-
-                    # did it change?
-                    if poly_param != p['default'] and poly_param != p['value']:
-                        changed = True
-
-                    # is it different from the default?
-                    if poly_param != p['default']:
-                        p['value'] = poly_param
-                        p['isSet'] = True
-
-        for p in self.internal:
-            if not p['isSet'] and p['isRequired']:
-                valid = False
+            custom = config['customParams']
+            for name in custom:
+                p = self.internal.get(name)
+                if p is None:
+                    continue
+                poly_param = custom[name]
+                old = self.current[name]
+                if poly_param == old:
+                    continue
+
+                changes[name] = (old, poly_param)
+                if poly_param != p['default']:
+                    p['value'] = poly_param
+                    p['isSet'] = True
+                else:
+                    p['value'] = ''
+                    p['isSet'] = False
+                self.current[name] = poly_param
 
-        return (valid, changed)
+        return (self.valid(), changes)
 
     def save_params(self, poly):
-        params = {}
-
-        for p in self.internal:
-            if p['isSet']:
-                params[p['name']] = p['value']
-            else:
-                params[p['name']] = p['default']
-
-        poly.addCustomParam(params)
-
-
+        poly.addCustomParam(dict(self.current))
@@ -0,0 +1,156 @@
+#
+#  Capture of the raw WeatherLink responses.
+#
+#  Each response body is appended, with the time it was received, to a
+#  gzip compressed file of JSON lines:
+#
+#     {"t": 1589210123.4, "station": "001D0A00DE6A",
+#      "source": "NoaaExt.json", "status": 200, "body": "{...}"}
+#
+#  When the file grows past max_bytes (compressed) it is rotated to
+#  <path>.1, <path>.1 to <path>.2 and so on, keeping backups old files.
+#
+#  Writing is done on a separate thread so a slow disk never holds up a
+#  poll.  If the writer falls behind, records are dropped (and counted)
+#  rather than queued without limit.
+#
+#  replay.py reads the files back to drive the node server offline.
+
+import os
+import gzip
+import json
+import time
+import queue
+import threading
+import polyinterface
+
+LOGGER = polyinterface.LOGGER
+
+MAX_BYTES = 5 * 1024 * 1024
+BACKUPS = 4
+QUEUE_SIZE = 100
+
+
+class Capture:
+    def __init__(self, path, max_bytes=MAX_BYTES, backups=BACKUPS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.queue = queue.Queue(QUEUE_SIZE)
+        self.dropped = 0
+        self.written = 0
+        self.raw = None
+        self.file = None
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='WeatherLinkCapture')
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        if self.thread is None:
+            return
+        try:
+            self.queue.put(None, timeout=timeout)
+        except queue.Full:
+            pass
+        self.thread.join(timeout)
+        self.thread = None
+
+    """
+        Queue a response to be written.  body is the raw response body
+        (bytes or text).  Never blocks.
+    """
+    def record(self, station, source, body, status=200, ts=None):
+        if ts is None:
+            ts = time.time()
+        if isinstance(body, bytes):
+            body = body.decode('utf-8', errors='replace')
+        try:
+            self.queue.put_nowait({'t': ts, 'station': station,
+                'source': source, 'status': status, 'body': body})
+        except queue.Full:
+            self.dropped += 1
+
+    def open(self):
+        self.raw = open(self.path, 'ab')
+        # each open starts a new gzip member, readers see one stream
+        self.file = gzip.GzipFile(fileobj=self.raw, mode='ab')
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.raw.close()
+            self.file = None
+            self.raw = None
+
+    def rotate(self):
+        self.close()
+        for n in range(self.backups - 1, 0, -1):
+            if os.path.exists('{}.{}'.format(self.path, n)):
+                os.replace('{}.{}'.format(self.path, n), '{}.{}'.format(self.path, n + 1))
+        if self.backups > 0:
+            os.replace(self.path, self.path + '.1')
+        else:
+            os.remove(self.path)
+        self.open()
+
+    def write(self, entry):
+        self.file.write(json.dumps(entry).encode('utf-8') + b'\n')
+        self.written += 1
+        if self.queue.empty():
+            self.file.flush()
+            if self.raw.tell() >= self.max_bytes:
+                self.rotate()
+
+    def run(self):
+        try:
+            self.open()
+        except OSError as e:
+            LOGGER.error('Failed to open capture file {}: {}'.format(self.path, str(e)))
+            return
+
+        LOGGER.info('Capturing WeatherLink responses to ' + self.path)
+        try:
+            while True:
+                entry = self.queue.get()
+                if entry is None:
+                    break
+                try:
+                    self.write(entry)
+                except (OSError, ValueError) as e:
+                    LOGGER.error('Capture write failed: ' + str(e))
+        finally:
+            self.close()
+
+
+# The capture files for a path, oldest first
+def files(path):
+    names = []
+    n = 1
+    while os.path.exists('{}.{}'.format(path, n)):
+        names.insert(0, '{}.{}'.format(path, n))
+        n += 1
+    if os.path.exists(path):
+        names.append(path)
+    return names
+
+
+"""
+    Read the records of a capture, oldest first.  With rotated is True
+    the rotated files are read first.  A record cut off by a crash ends
+    the file it is in.
+"""
+def read(path, rotated=True):
+    for name in (files(path) if rotated else [path]):
+        try:
+            with gzip.open(name, 'rt', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        break
+        except (EOFError, OSError) as e:
+            LOGGER.warning('Capture file {} is truncated: {}'.format(name, str(e)))
@@ -4,23 +4,51 @@ Polyglot v2 node server for Davis WeatherLink Weather Station data.
 Copyright (c) 2020 Robert Paauwe
 """
 import polyinterface
-import sys
 import time
-import datetime
-import requests
-import json
-import socket
-import math
 import threading
+import concurrent.futures
 import node_funcs
 from nodes import day
 from nodes import month
 from nodes import year
 from nodes import uom
-from nodes import trend
+from nodes import schema
+from nodes import transport
+from nodes import station
+from nodes import extract
+from nodes import pipeline
+from nodes import resilience
+from nodes import history
+from nodes import schedule
+from nodes import extremes
+from nodes import metadata
+from nodes import decode
+from nodes import metrics
+from nodes import wll
+from nodes import v2
+from nodes import rolling
+from nodes import capture
+from nodes import freshness
+from nodes import publish
 
 LOGGER = polyinterface.LOGGER
 
+API_URL = 'https://api.weatherlink.com/v1/'
+# Maximum number of stations queried at the same time
+MAX_WORKERS = 8
+# Saved local day/month/year extremes
+EXTREMES_FILE = 'extremes.json'
+# Last published driver values, restored at startup
+SNAPSHOT_FILE = 'snapshot.json'
+# Minimum seconds between snapshot writes
+SNAPSHOT_INTERVAL = 5
+# Profile files, generated from the node schema
+PROFILE_DIR = 'profile'
+# Hash of the last profile installed
+PROFILE_HASH_FILE = 'profile_hash.json'
+# Parameters that define the stations polled
+STATION_PARAMS = ('Device ID', 'Password', 'API Token', 'Stations', 'API Key', 'API Secret')
+
 @node_funcs.add_functions_as_methods(node_funcs.functions)
 class Controller(polyinterface.Controller):
     def __init__(self, polyglot):
@@ -35,8 +63,32 @@ class Controller(polyinterface.Controller):
         self.devices = []
         self.discovered = ""
         self.configured = False
-        self.tags = {}
         self.hb = 0
+        self.transport = None
+        self.stations = []
+        self.executor = None
+        self.units = 'us'
+        self.plan = extract.current_plan(self.units)
+        self.extractor = extract.Extractor()
+        self.decoder = decode.Decoder()
+        self.metrics = metrics.Metrics()
+        self.freshness = freshness.Freshness(self.metrics)
+        self.publisher = publish.PublishBuffer(self.metrics)
+        self.stale_age = freshness.DEFAULT_STALE_AGE
+        # driver deadband overrides and republish age, shared by all of
+        # the nodes
+        self.deadbands = {}
+        self.max_age = node_funcs.MAX_AGE
+        # held while publishing so a unit change is applied between
+        # observations
+        self.units_lock = threading.RLock()
+        self.history = None
+        self.capture = None
+        self.broadcast = None
+        self.v2 = None
+        self.started = False
+        self.snapshot_saved = 0
+        self.pipeline = pipeline.Pipeline(self)
         self.params = node_funcs.NSParameters([{
             'name': 'Device ID',
             'default': 'set me',
@@ -62,65 +114,513 @@ class Controller(polyinterface.Controller):
             'notice': '',
             },
             {
+            'name': 'Stations',
+            'default': '',
+            'isRequired': False,
+            'notice': '',
+            },
+            {
             'name': 'Units',
             'default': 'us',
             'isRequired': False,
             'notice': '',
             },
+            {
+            'name': 'API URL',
+            'default': API_URL,
+            'isRequired': False,
+            'notice': '',
+            },
+            {
+            'name': 'History File',
+            'default': '',
+            'isRequired': False,
+            'notice': '',
+            },
+            {
+            'name': 'Connect Timeout',
+            'default': '5',
+            'isRequired': False,
+            'notice': '',
+            },
+            {
+            'name': 'Read Timeout',
+            'default': '15',
+            'isRequired': False,
+            'notice': '',
+            },
+            {
+            'name': 'Capture File',
+            'default': '',
+            'isRequired': False,
+            'notice': '',
+            },
+            {
+            'name': 'API Key',
+            'default': '',
+            'isRequired': False,
+            'notice': '',
+            },
+            {
+            'name': 'API Secret',
+            'default': '',
+            'isRequired': False,
+            'notice': '',
+            },
+            {
+            'name': 'WLL Address',
+            'default': '',
+            'isRequired': False,
+            'notice': '',
+            },
+            {
+            'name': 'Metrics File',
+            'default': '',
+            'isRequired': False,
+            'notice': '',
+            },
+            {
+            'name': 'Metrics Drivers',
+            'default': 'false',
+            'isRequired': False,
+            'notice': '',
+            },
+            {
+            'name': 'Deadbands',
+            'default': '',
+            'isRequired': False,
+            'notice': '',
+            },
+            {
+            'name': 'Republish Age',
+            'default': str(node_funcs.MAX_AGE),
+            'isRequired': False,
+            'notice': '',
+            },
+            {
+            'name': 'Stale Age',
+            'default': str(freshness.DEFAULT_STALE_AGE),
+            'isRequired': False,
+            'notice': '',
+            },
             ])
 
     def process_config(self, config):
-        (valid, changed) = self.params.update_from_polyglot(config)
-        if changed and not valid:
+        (valid, changes) = self.params.update_from_polyglot(config)
+        valid = valid or self.v2_configured()
+        if changes and not valid:
             LOGGER.debug('-- configuration not yet valid')
             self.removeNoticesAll()
             self.params.send_notices(self)
-        elif changed and valid:
+        elif changes and valid:
             LOGGER.debug('-- configuration is valid')
             self.removeNoticesAll()
             self.configured = True
-            # Really need to do better at detecting what changed and
-            # respond accordingly
+            self.reconfigure(changes)
         elif valid:
             LOGGER.debug('-- configuration not changed, but is valid')
 
+    """
+        Apply the parameters that changed while running, without a
+        restart or rediscovery.
+    """
+    def reconfigure(self, changes):
+        if not self.started:
+            # start() uses the new configuration
+            return
+
+        LOGGER.info('Configuration changed: ' + ', '.join(changes))
+
+        if any(name in changes for name in STATION_PARAMS):
+            self.open_v2()
+            self.update_stations()
+            # don't reuse connections made with the old credentials
+            self.close_transport()
+            self.open_transport()
+        elif 'Connect Timeout' in changes or 'Read Timeout' in changes:
+            self.open_transport()
+
+        if 'Units' in changes:
+            self.switch_units(self.params.get('Units'))
+
+        if 'History File' in changes:
+            self.close_history()
+            self.open_history()
+
+        if 'Capture File' in changes:
+            self.close_capture()
+            self.open_capture()
+
+        if 'Deadbands' in changes or 'Republish Age' in changes:
+            self.set_deadbands()
+
+        if 'Stale Age' in changes:
+            self.set_stale_age()
+            self.update_status()
+
+        if 'WLL Address' in changes or any(name in changes for name in STATION_PARAMS):
+            self.close_live()
+            self.open_live()
+
+        # API URL changes are picked up by the next query, the station
+        # URLs are cached per base URL.
+        self.pipeline.wake()
+
     def start(self):
         LOGGER.info('Starting Davis WeatherLink Node Server')
         self.set_logging_level()
+        self.check_profile()
         self.check_params()
+        self.set_deadbands()
+        self.set_stale_age()
+        self.open_transport()
+        self.open_v2()
+        self.build_stations()
+        self.load_extremes()
+        self.load_metadata()
         self.discover()
-        self.uom = uom.get_uom(self.params.get('Units'))
-        self.set_tags(self.params.get('Units'))
+        self.compile_plans(self.params.get('Units'))
+        self.restore_snapshot()
+        self.open_history()
+        self.open_capture()
+        self.open_live()
+        self.started = True
 
-        # do initial query to get data
+        # Start fetching in the background, the first query happens
+        # right away.
+        self.pipeline.start()
         if self.configured:
-            self.get_data()
+            self.pipeline.wake()
 
     def shortPoll(self):
         if self.configured:
-            self.get_data()
+            self.pipeline.check()
+            self.pipeline.wake()
+            # the data age keeps growing between observations
+            self.update_status()
 
     def longPoll(self):
         self.heartbeat()
+        if self.v2 is not None and len(self.v2.stations) == 0:
+            # discovery failed at startup, try again
+            self.open_v2()
+            self.update_stations()
+        if self.history is not None:
+            self.history.maintain()
+        self.save_extremes()
+        self.save_snapshot(True)
+        self.publish_metrics()
 
     def query(self):
         for node in self.nodes:
             self.nodes[node].reportDrivers()
 
     def discover(self, *args, **kwargs):
+        for st in self.stations:
+            self.add_station_nodes(st)
+
+    def add_station_nodes(self, st):
+        if st.prefix != '':
+            node = station.StationNode(self, self.address, st.address('cc'), st.name + 'Current Conditions')
+            node.SetUnits(self.params.get('Units'))
+            node.metrics = self.metrics
+            node.publisher = self.publisher
+            node.deadbands = self.deadbands
+            node.max_age = self.max_age
+            self.addNode(node)
 
-        node = day.DayNode(self, self.address, 'day', 'Daily Observations')
+        node = day.DayNode(self, self.address, st.address('day'), st.name + 'Daily Observations')
         node.SetUnits(self.params.get('Units'))
+        node.metrics = self.metrics
+        node.publisher = self.publisher
+        node.deadbands = self.deadbands
+        node.max_age = self.max_age
         self.addNode(node)
 
-        node = month.MonthNode(self, self.address, 'month', 'Month Observations')
+        node = month.MonthNode(self, self.address, st.address('month'), st.name + 'Month Observations')
         node.SetUnits(self.params.get('Units'))
+        node.metrics = self.metrics
+        node.publisher = self.publisher
+        node.deadbands = self.deadbands
+        node.max_age = self.max_age
         self.addNode(node)
 
-        node = year.YearNode(self, self.address, 'year', 'Yearly Observations')
+        node = year.YearNode(self, self.address, st.address('year'), st.name + 'Yearly Observations')
         node.SetUnits(self.params.get('Units'))
+        node.metrics = self.metrics
+        node.publisher = self.publisher
+        node.deadbands = self.deadbands
+        node.max_age = self.max_age
         self.addNode(node)
 
+    """
+        Return the (device id, password, api token) list of the stations
+        configured.  The first is the station configured by the Device
+        ID, Password and API Token parameters, followed by any listed in
+        the Stations parameter.  With the v2 API, the stations are the
+        ones discovered for the API key and the device id is the v2
+        station id.
+    """
+    def station_credentials(self):
+        if self.v2 is not None:
+            return [(str(s.get('station_id')), '', '') for s in self.v2.stations]
+
+        credentials = [(self.params.get('Device ID'),
+            self.params.get('Password'),
+            self.params.get('API Token'))]
+        credentials.extend(station.parse_station_list(self.params.get('Stations')))
+        return credentials
+
+    def new_station(self, index, did, password, token):
+        st = station.Station(index, did, password, token)
+        st.extremes = extremes.Extremes(self.params.get('Units'))
+        st.rolling = rolling.Rolling()
+        if self.v2 is not None:
+            st.v2 = int(did)
+            st.zone = self.v2.station_zone(st.v2)
+            name = self.v2.station_name(st.v2)
+            if index > 0 and name:
+                st.name = name + ' '
+        return st
+
+    def build_stations(self):
+        self.stations = []
+        for (did, password, token) in self.station_credentials():
+            self.stations.append(self.new_station(len(self.stations), did, password, token))
+
+        LOGGER.info('Polling {} station(s)'.format(len(self.stations)))
+
+    """
+        Update the stations polled after the station parameters change.
+        Stations with the same device id keep their state and only get
+        the new credentials.  A different device id at the same position
+        starts fresh (using the existing nodes), and new stations get
+        their nodes added.  Stations removed are no longer polled.
+    """
+    def update_stations(self):
+        stations = []
+        for (did, password, token) in self.station_credentials():
+            index = len(stations)
+            st = self.stations[index] if index < len(self.stations) else None
+            if st is not None and st.device_id == did and (st.v2 is None) == (self.v2 is None):
+                st.set_credentials(did, password, token)
+            else:
+                st = self.new_station(index, did, password, token)
+                if index >= len(self.stations):
+                    self.add_station_nodes(st)
+            st.breaker.success()
+            st.schedule.reset()
+            stations.append(st)
+
+        # replace the list in one step, the fetch thread may be using it
+        self.stations = stations
+        LOGGER.info('Polling {} station(s)'.format(len(self.stations)))
+
+    def set_units(self, units):
+        self.compile_plans(units)
+        for address in self.nodes:
+            node = self.nodes[address]
+            if node is not self and hasattr(node, 'SetUnits'):
+                node.SetUnits(units)
+        for st in self.stations:
+            st.extremes.units = extremes.unit_system(units)
+
+    """
+        Switch to a different unit configuration while running.  The
+        plans and UOM tables are swapped between observations and then
+        the drivers whose UOM changed are published again from each
+        station's last observation, without querying the server.
+    """
+    def switch_units(self, units):
+        with self.units_lock:
+            if units == self.units:
+                return
+            LOGGER.info('Switching units from {} to {}'.format(self.units, units))
+            old_uom = self.uom
+            self.set_units(units)
+
+            with self.publisher.cycle():
+                for st in self.stations:
+                    obs = st.last_payload
+                    if obs is None:
+                        continue
+                    try:
+                        current = self.current_updates(obs, st)
+                        self.current_node(st).update_drivers(
+                                [u for u in current if old_uom[u[0]] != self.uom[u[0]]])
+                        updates = self.period_updates(st, obs)
+                        for period in extract.PERIODS:
+                            self.nodes[st.address(period)].update_drivers(
+                                    [u for u in updates[period] if old_uom[u[0]] != self.uom[u[0]]])
+                    except Exception as e:
+                        LOGGER.error('Failed to publish in new units: ' + str(e))
+
+    # Command to change the units, the Units parameter is updated to match
+    def set_units_cmd(self, command):
+        units = uom.SYSTEMS[int(command['value'])]
+        self.params.set('Units', units)
+        self.params.save_params(self)
+        self.switch_units(units)
+
+    def load_extremes(self):
+        data = node_funcs.load_json(EXTREMES_FILE)
+        if data is None:
+            return
+        for st in self.stations:
+            if st.device_id in data:
+                st.extremes.from_dict(data[st.device_id])
+
+    def load_metadata(self):
+        data = node_funcs.load_json(metadata.METADATA_FILE)
+        if data is None:
+            return
+        for st in self.stations:
+            if st.device_id in data:
+                st.metadata.from_dict(data[st.device_id])
+                self.apply_metadata(st)
+
+    def save_metadata(self):
+        data = {}
+        for st in self.stations:
+            if st.metadata.data is not None:
+                data[st.device_id] = st.metadata.to_dict()
+        node_funcs.save_json(metadata.METADATA_FILE, data)
+
+    """
+        Fetch the station's StationStatus.json metadata if the cached
+        copy has expired.
+    """
+    def check_metadata(self, st):
+        now = time.time()
+        if not st.metadata.needs_refresh(now):
+            return
+
+        try:
+            c = self.transport.get(st.url(self.api_url(), 'StationStatus.json'))
+            body = c.content
+            c.close()
+            if self.capture is not None:
+                self.capture.record(st.device_id, 'StationStatus.json', body, c.status_code)
+            c.raise_for_status()
+            data = decode.loads(body)
+        except Exception as e:
+            LOGGER.error('{}station status request failed: {}'.format(st.name, str(e)))
+            st.metadata.failed(now)
+            return
+
+        was_offline = st.metadata.offline
+        st.metadata.update(data, now)
+        self.apply_metadata(st)
+        self.save_metadata()
+
+        if st.metadata.offline and not was_offline:
+            LOGGER.warning('{}console is offline, pausing queries'.format(st.name))
+        elif was_offline and not st.metadata.offline:
+            LOGGER.info('{}console is back online'.format(st.name))
+
+    def apply_metadata(self, st):
+        zone = st.metadata.zone()
+        if zone is not None:
+            st.zone = zone
+
+        # Consoles that only upload archive records get new data once
+        # per archive interval.
+        if st.metadata.uploads_loop():
+            st.schedule.default_interval = None
+        else:
+            st.schedule.default_interval = st.metadata.archive_interval
+
+    def save_extremes(self):
+        data = {}
+        for st in self.stations:
+            data[st.device_id] = st.extremes.to_dict()
+        node_funcs.save_json(EXTREMES_FILE, data)
+
+    """
+        Save the last value published for each node's drivers and the
+        time of each station's last observation.  This is called after
+        every publish so writes are limited to one every
+        SNAPSHOT_INTERVAL seconds unless forced.
+    """
+    def save_snapshot(self, force=False):
+        now = time.time()
+        if not force and now - self.snapshot_saved < SNAPSHOT_INTERVAL:
+            return
+        self.snapshot_saved = now
+
+        data = {'nodes': {}, 'observed': {}}
+        # the controller is in nodes under both 'controller' and its
+        # own address, save each node once
+        seen = set()
+        for node in list(self.nodes.values()):
+            if id(node) in seen:
+                continue
+            seen.add(id(node))
+            published = dict(getattr(node, 'published', None) or {})
+            # the server status reflects this run, not the last one
+            published.pop('ST', None)
+            if len(published) > 0:
+                data['nodes'][node.address] = published
+        for st in self.stations:
+            if st.observed is not None:
+                data['observed'][st.device_id] = st.observed
+        node_funcs.save_json(SNAPSHOT_FILE, data)
+
+    """
+        Publish the driver values saved by the last run so the nodes
+        show the last observation right away instead of waiting for the
+        first query.  Values saved in different units are skipped.
+    """
+    def restore_snapshot(self):
+        data = node_funcs.load_json(SNAPSHOT_FILE)
+        if data is None:
+            return
+
+        count = 0
+        nodes = data.get('nodes') or {}
+        for address in nodes:
+            # the controller may not be in nodes under its address yet
+            node = self if address == self.address else self.nodes.get(address)
+            if node is None:
+                continue
+            if getattr(node, 'published', None) is None:
+                node.published = {}
+            for driver in nodes[address]:
+                try:
+                    (value, unit, ts) = nodes[address][driver]
+                    if node.uom.get(driver) != unit:
+                        continue
+                    node.setDriver(driver, value, True, True, unit)
+                    # the restored value counts as published, so an
+                    # unchanged first observation isn't sent again
+                    node.published[driver] = (value, unit, ts)
+                    count += 1
+                except (KeyError, TypeError, ValueError):
+                    continue
+
+        now = time.time()
+        observed = data.get('observed') or {}
+        for st in self.stations:
+            if st.device_id in observed:
+                st.observed = observed[st.device_id]
+                LOGGER.info('{}restored the observation from {:.0f} seconds ago'.format(st.name, now - st.observed))
+        LOGGER.info('Restored {} driver values from {}'.format(count, SNAPSHOT_FILE))
+
+    """
+        Seconds until the next station is expected to upload, or None
+        if no upload time is known.  Stations that are already due are
+        picked up by the next short poll.
+    """
+    def next_fetch_delay(self):
+        now = time.time()
+        delay = None
+        for st in self.stations:
+            for when in (st.schedule.next_poll, st.breaker.next_attempt):
+                wait = when - now
+                if wait > 0 and (delay is None or wait < delay):
+                    delay = wait
+        return delay
+
     def heartbeat(self):
         LOGGER.debug('heartbeat hb={}'.format(self.hb))
         if self.hb == 0:
@@ -132,16 +632,141 @@ class Controller(polyinterface.Controller):
 
     def delete(self):
         self.stopping = True
+        self.close_live()
+        self.pipeline.stop(1)
+        self.close_executor()
+        self.close_transport()
+        self.close_history()
+        self.close_capture()
+        self.save_extremes()
+        self.save_snapshot(True)
         LOGGER.info('Removing Davis WeatherLink node server.')
 
     def stop(self):
         self.stopping = True
+        self.close_live()
+        self.pipeline.stop(1)
+        self.close_executor()
+        self.close_transport()
+        self.close_history()
+        self.close_capture()
+        self.save_extremes()
+        self.save_snapshot(True)
+        self.save_metrics()
         LOGGER.debug('Stopping Davis WeatherLink node server.')
 
+    def open_transport(self):
+        connect = transport.to_timeout(self.params.get('Connect Timeout'),
+                transport.DEFAULT_CONNECT_TIMEOUT)
+        read = transport.to_timeout(self.params.get('Read Timeout'),
+                transport.DEFAULT_READ_TIMEOUT)
+
+        if self.transport is None:
+            self.transport = transport.Transport(connect, read, MAX_WORKERS)
+        else:
+            self.transport.set_timeouts(connect, read)
+        self.transport.open()
+
+    def close_transport(self):
+        if self.transport is not None:
+            self.transport.close()
+
+    def open_history(self):
+        path = self.params.get('History File')
+        if path == '' or self.history is not None:
+            return
+        try:
+            self.history = history.History(path)
+            self.history.open()
+        except Exception as e:
+            LOGGER.error('Failed to open history file {}: {}'.format(path, str(e)))
+            self.history = None
+
+    def close_history(self):
+        if self.history is not None:
+            self.history.close()
+            self.history = None
+
+    # Capture the raw responses for replay.py
+    def open_capture(self):
+        path = self.params.get('Capture File')
+        if path == '' or self.capture is not None:
+            return
+        self.capture = capture.Capture(path).start()
+
+    def close_capture(self):
+        if self.capture is not None:
+            self.capture.stop(2)
+            self.capture = None
+
+    def v2_configured(self):
+        return self.params.get('API Key') != '' and self.params.get('API Secret') != ''
+
+    """
+        With the v2 API Key and API Secret configured, the stations are
+        discovered and read with the v2 API instead of the v1 API.
+    """
+    def open_v2(self):
+        if not self.v2_configured():
+            self.v2 = None
+            return
+
+        base = self.api_url()
+        base = base[:-3] + 'v2/' if base.endswith('v1/') else v2.API_V2_URL
+        client = v2.Client(self.params.get('API Key'), self.params.get('API Secret'),
+                self.transport, base)
+        try:
+            client.discover()
+        except Exception as e:
+            LOGGER.error('WeatherLink v2 station discovery failed: ' + str(e))
+        self.v2 = client
+
+    """
+        With a WeatherLink Live address configured, the primary station
+        is read from the hub on the local network instead of the cloud
+        API, and the hub's real-time broadcasts update the wind and rain
+        between polls.
+    """
+    def open_live(self):
+        address = self.params.get('WLL Address')
+        if address == '' or len(self.stations) == 0:
+            return
+        st = self.stations[0]
+        st.live = wll.LiveClient(address, self.transport)
+        st.schedule.reset()
+        self.broadcast = wll.Broadcast(st.live, lambda packet: self.realtime(st, packet)).start()
+        LOGGER.info('Reading station data from WeatherLink Live at ' + address)
+
+    def close_live(self):
+        if self.broadcast is not None:
+            self.broadcast.stop(wll.RECEIVE_TIMEOUT * 2)
+            self.broadcast = None
+        for st in self.stations:
+            st.live = None
+
+    """
+        Publish a real-time packet from the WeatherLink Live hub.  This
+        runs on the broadcast listener's thread.
+    """
+    def realtime(self, st, packet):
+        newer = decode.from_payload(wll.to_payload(packet, zone=st.zone))
+        with st.payload_lock:
+            obs = wll.merge(st.last_payload, newer)
+            st.last_payload = obs
+            st.last_received = time.time()
+        with self.units_lock, self.publisher.cycle():
+            self.publish_station(st, obs)
+
+    def close_executor(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
     def check_params(self):
         self.removeNoticesAll()
 
-        if self.params.get_from_polyglot(self):
+        valid = self.params.get_from_polyglot(self)
+        if valid or self.v2_configured():
             LOGGER.debug('All required parameters are set!')
             self.configured = True
         else:
@@ -155,57 +780,321 @@ class Controller(polyinterface.Controller):
 
     def update_profile(self,command):
         LOGGER.info('update_profile:')
+        return self.check_profile(True)
+
+    """
+        Regenerate the profile files from the node schema and install
+        them if they changed since the last install (or force is True).
+        The profile install makes the ISY reload the node definitions so
+        it is skipped when nothing changed.
+    """
+    def check_profile(self, force=False):
+        files = schema.profile_files()
+        digest = schema.profile_hash(files)
+        written = schema.write_profile(PROFILE_DIR, files)
+        if len(written) > 0:
+            LOGGER.info('Updated profile files: ' + ', '.join(written))
+
+        saved = node_funcs.load_json(PROFILE_HASH_FILE)
+        if not force and saved is not None and saved.get('hash') == digest:
+            LOGGER.debug('Profile unchanged, skipping install')
+            return None
+
+        LOGGER.info('Installing profile ' + digest[:12])
         st = self.poly.installprofile()
+        node_funcs.save_json(PROFILE_HASH_FILE, {'hash': digest})
         return st
 
-    def parse_current_conditions(self, jdata):
+    """
+        Build the conversion plans for the unit configuration.  The
+        plans are cached per unit configuration so polls don't need to
+        look up tags, units or precisions.
+    """
+    def compile_plans(self, units):
+        self.units = units
+        self.uom = schema.get_uom(units)
+        self.plan = extract.current_plan(units)
+        self.extractor = extract.Extractor(units)
+
+    """
+        Return the current conditions updates for an observation.  The
+        station's rolling window values replace the payload's values
+        for the same drivers (i.e. the pressure trend) once there is
+        enough history for them.
+    """
+    def current_updates(self, obs, st=None):
+        updates = extract.current_conditions(self.plan, obs)
+        if st is None:
+            return updates
+        local = st.rolling.updates(self.units)
+        drivers = set(u[0] for u in local)
+        return [u for u in updates if u[0] not in drivers] + local
+
+    def parse_current_conditions(self, obs, node=None, st=None):
+        if node is None:
+            node = self
         try:
-            self.update_driver('CLITEMP', jdata[self.tags['temp']])
-            self.update_driver('CLIHUM', jdata[self.tags['humidity']])
-            self.update_driver('DEWPT', jdata[self.tags['dewpoint']])
-            self.update_driver('GV3', jdata[self.tags['heat_index']])
-            self.update_driver('GV4', jdata[self.tags['windchill']])
-            self.update_driver('BARPRES', jdata[self.tags['pressure']])
-            self.update_driver('WINDDIR', jdata[self.tags['wind_dir']])
-            if self.params.get('Units') == 'us':
-                self.update_driver('SPEED', jdata[self.tags['wind_speed']])
-            else:
-                speed = uom.kt2kph(float(jdata[self.tags['wind_speed']]))
-                self.update_driver('SPEED', speed)
-            trending = trend.get_trend(jdata['davis_current_observation']['pressure_tendency_string'])
-            self.update_driver('GV16', trending)
-            self.update_driver('SOLRAD', jdata['davis_current_observation']['solar_radiation'])
+            node.update_drivers(self.current_updates(obs, st))
             # what about soil temperatures?
             # temp_soil_1, temp_soil_2, temp_soil_3, temp_soil_4
         except Exception as e:
             LOGGER.error('Parsing failed, current conditions: ' + str(e))
-            LOGGER.debug(jdata)
+            LOGGER.debug('Missing values: ' + ', '.join(obs.missing()))
 
 
+    """
+        Query and publish all the stations that are due.  This runs
+        synchronously on the calling thread, normally the fetch and
+        publish happen on the pipeline threads.
+    """
     def get_data(self):
-        path = 'https://api.weatherlink.com/v1/NoaaExt.json?'
-        path += 'user=' + self.params.get('Device ID')
-        path += '&pass=' + self.params.get('Password')
-        path += '&apiToken=' + self.params.get('API Token')
+        for (st, obs) in self.fetch_due():
+            self.process_fetched(st, obs, st.last_received)
+
+    """
+        Query all the stations that are due at the same time so that a
+        poll takes about as long as the slowest station.  Yields
+        (station, payload) for each new observation as it arrives.
+    """
+    def fetch_due(self):
+        now = time.time()
+        due = [st for st in self.stations if st.schedule.due(now) and st.breaker.allow(now)]
+        if len(due) == 0:
+            return
+        start = time.perf_counter()
+
+        if len(due) == 1:
+            results = [(due[0], self.query_station(due[0]))]
+        else:
+            if self.executor is None:
+                # sized for MAX_WORKERS, not the current station list,
+                # so stations added later are still fetched in
+                # parallel.  The threads are only started as needed.
+                self.executor = concurrent.futures.ThreadPoolExecutor(
+                        max_workers=MAX_WORKERS,
+                        thread_name_prefix='WeatherLink')
+
+            futures = {self.executor.submit(self.query_station, st): st for st in due}
+            results = ((futures[f], f.result()) for f in concurrent.futures.as_completed(futures))
+
+        for (st, obs) in results:
+            if obs is None:
+                continue
+            if not st.schedule.is_new(obs):
+                LOGGER.debug('Observation unchanged, skipping update')
+                continue
+            yield (st, obs)
+
+        self.metrics.observe('poll_seconds', time.perf_counter() - start)
+        self.update_status()
+
+    """
+        Publish the metric summaries as controller drivers, if enabled,
+        and write the full set to the metrics file.
+    """
+    def publish_metrics(self):
+        if self.params.get('Metrics Drivers').lower() == 'true':
+            fetch = self.metrics.value('fetch_seconds', 0.5)
+            if fetch is not None:
+                self.update_driver('GV21', fetch * 1000, prec=1)
+            fetch = self.metrics.value('fetch_seconds', 0.95)
+            if fetch is not None:
+                self.update_driver('GV22', fetch * 1000, prec=1)
+            sent = self.metrics.value('driver_updates_sent_total')
+            suppressed = self.metrics.value('driver_updates_suppressed_total')
+            if sent + suppressed > 0:
+                self.update_driver('GV23', 100.0 * suppressed / (sent + suppressed), prec=1)
+            self.update_driver('GV24', self.metrics.maximum('consecutive_failures'), prec=0)
+            latency = self.freshness.percentile(0.95)
+            if latency is not None:
+                self.update_driver('GV26', latency, prec=0)
+
+        self.freshness.update_metrics(self.freshness.data_age(self.stations, time.time()))
+        self.save_metrics()
+
+    def save_metrics(self):
+        path = self.params.get('Metrics File')
+        if path != '':
+            self.metrics.save(path)
+
+    """
+        Show the state of the station queries in the ST driver and the
+        age of the data in GV25.  While the queries are working but the
+        data is older than the Stale Age parameter, ST shows Stale.
+    """
+    def update_status(self):
+        state = resilience.combined_state([st.breaker for st in self.stations])
+        age = self.freshness.data_age(self.stations, time.time())
+        if age is not None:
+            self.update_driver('GV25', age, prec=0)
+        if state == resilience.CLOSED and freshness.is_stale(age, self.stale_age):
+            state = freshness.STALE
+        self.update_driver('ST', state, prec=0)
+
+    """
+        Apply the Deadbands and Republish Age parameters to every node.
+        Drivers not listed keep the default band for their UOM (see
+        node_funcs.DEADBANDS).
+    """
+    def set_deadbands(self):
+        self.deadbands = node_funcs.parse_deadbands(self.params.get('Deadbands'))
+        self.max_age = freshness.to_threshold(self.params.get('Republish Age'), node_funcs.MAX_AGE, 'republish age')
+        for node in self.nodes.values():
+            node.deadbands = self.deadbands
+            node.max_age = self.max_age
+
+    def set_stale_age(self):
+        self.stale_age = freshness.to_threshold(self.params.get('Stale Age'))
 
+    def api_url(self):
+        url = self.params.get('API URL')
+        if not url.endswith('/'):
+            url += '/'
+        return url
+
+    def query_station(self, st):
+        if st.v2 is None:
+            # the hub's payload also needs the station's time zone from
+            # the metadata
+            self.check_metadata(st)
+        if st.live is not None:
+            return self.query_client(st, lambda: st.live.payload(st.zone), 'WeatherLink Live')
+        if st.v2 is not None:
+            return self.query_client(st, lambda: self.v2.payload(st.v2, st.zone), 'WeatherLink v2')
+
+        if st.metadata.offline:
+            LOGGER.debug('{}console offline, skipping query'.format(st.name))
+            return None
+
+        labels = {'station': st.device_id}
+        requested = time.time()
         try:
-            c = requests.get(path)
+            with self.metrics.timer('fetch_seconds'):
+                c = self.transport.get(st.url(self.api_url()))
+                body = c.content
             LOGGER.debug('Query response = ' + str(c.status_code))
-            jdata = c.json()
             c.close()
+            if self.capture is not None:
+                self.capture.record(st.device_id, 'NoaaExt.json', body, c.status_code)
+            self.metrics.observe('fetch_bytes', len(body))
+            c.raise_for_status()
+            with self.metrics.timer('decode_seconds'):
+                obs = self.decode(body)
         except Exception as e:
+            now = time.time()
+            retry = st.breaker.failure(now)
+            self.metrics.inc('fetch_failures_total', labels=labels)
+            self.metrics.set('consecutive_failures', st.breaker.failures, labels)
             LOGGER.error('request failed: ' + str(e))
-            return
+            age = st.payload_age(now)
+            if age is not None:
+                LOGGER.warning('{}using last good observation from {:.0f} seconds ago, retry in {:.0f} seconds'.format(st.name, age, retry))
+            else:
+                LOGGER.warning('{}no observation yet, retry in {:.0f} seconds'.format(st.name, retry))
+            return None
+
+        st.breaker.success()
+        self.metrics.set('consecutive_failures', 0, labels)
+        st.set_payload(obs, requested)
+        return obs
+
+    """
+        Query a station with a client that returns an Observation,
+        the WeatherLink Live hub or the v2 API.
+    """
+    def query_client(self, st, fetch, source):
+        labels = {'station': st.device_id}
+        requested = time.time()
+        try:
+            with self.metrics.timer('fetch_seconds'):
+                obs = fetch()
+        except Exception as e:
+            retry = st.breaker.failure()
+            self.metrics.inc('fetch_failures_total', labels=labels)
+            self.metrics.set('consecutive_failures', st.breaker.failures, labels)
+            LOGGER.error('{}{} request failed: {}, retry in {:.0f} seconds'.format(st.name, source, str(e), retry))
+            return None
+
+        st.breaker.success()
+        self.metrics.set('consecutive_failures', 0, labels)
+        st.set_payload(obs, requested)
+        return obs
+
+    def decode(self, body):
+        return self.decoder.decode(body)
 
+    # The node with the station's current conditions
+    def current_node(self, st):
+        if st.prefix == '':
+            return self
+        return self.nodes[st.address('cc')]
+
+    """
+        Return the day/month/year updates for an observation.  The
+        locally calculated values are used for any of the period values
+        the payload doesn't have.
+    """
+    def period_updates(self, st, obs):
+        updates = self.extractor.extract(obs)
+        for period in extract.PERIODS:
+            have = set(u[0] for u in updates[period])
+            updates[period].extend(u for u in st.extremes.updates(period) if u[0] not in have)
+        return updates
+
+    """
+        Publish an observation returned by a poll and record how long
+        each stage took, from the station to the last driver update.
+    """
+    def process_fetched(self, st, obs, received=None):
+        if received is None:
+            received = time.time()
+        self.process_station(st, obs, received)
+        self.freshness.record(schedule.observation_epoch(obs, received),
+                st.last_requested, received, time.time())
+        self.update_status()
+
+    """
+        Publish a new observation.  now is when it was received, replay
+        passes the time from the capture.
+    """
+    def process_station(self, st, obs, now=None):
+        if now is None:
+            now = time.time()
+        with self.units_lock, self.publisher.cycle():
+            self.publish_station(st, obs, now)
+
+        if self.history is not None:
+            epoch = schedule.observation_epoch(obs, now)
+            self.history.record(st.device_id, epoch if epoch is not None else now, obs)
+
+    def publish_station(self, st, obs, now=None):
+        if now is None:
+            now = time.time()
         try:
-            self.parse_current_conditions(jdata)
-            self.nodes['day'].parse(jdata)
-            self.nodes['month'].parse(jdata)
-            self.nodes['year'].parse(jdata)
+            node = self.current_node(st)
+            with self.metrics.timer('parse_seconds', {'node': node.address}):
+                observed = schedule.observation_epoch(obs, now)
+                if observed is not None:
+                    st.observed = observed
+                st.rolling.update(obs, observed)
+                self.parse_current_conditions(obs, node, st)
+
+            with self.metrics.timer('parse_seconds', {'node': 'extract'}):
+                st.extremes.update(extremes.local_values(obs),
+                        extremes.local_time(obs))
+                updates = self.period_updates(st, obs)
+
+            for period in extract.PERIODS:
+                address = st.address(period)
+                with self.metrics.timer('parse_seconds', {'node': address}):
+                    self.nodes[address].update_drivers(updates[period])
+
+            self.save_snapshot()
         except Exception as e:
             LOGGER.error('parsing failed: ' + str(e))
 
 
+
     def set_logging_level(self, level=None):
         if level is None:
             try:
@@ -224,30 +1113,6 @@ class Controller(polyinterface.Controller):
         LOGGER.info('set_logging_level: Setting log level to %d' % level)
         LOGGER.setLevel(level)
 
-    def set_tags(self, units):
-        if units == 'us':
-            self.tags = {
-                    'dewpoint':'dewpoint_f',
-                    'heat_index': 'heat_index_f',
-                    'pressure': 'pressure_in',
-                    'humidity': 'relative_humidity',
-                    'temp': 'temp_f',
-                    'wind_dir': 'wind_degrees',
-                    'wind_speed': 'wind_mph',
-                    'windchill': 'windchill_f'
-                    }
-        else:
-            self.tags = {
-                    'dewpoint':'dewpoint_c',
-                    'heat_index': 'heat_index_c',
-                    'pressure': 'pressure_mb',
-                    'humidity': 'relative_humidity',
-                    'temp': 'temp_c',
-                    'wind_dir': 'wind_degrees',
-                    'wind_speed': 'wind_kt',
-                    'windchill': 'windchill_c'
-                    }
-
     id = 'WeatherLink'
     name = 'WeatherLink'
     address = 'wl'
@@ -258,20 +1123,9 @@ class Controller(polyinterface.Controller):
         'UPDATE_PROFILE': update_profile,
         'REMOVE_NOTICES_ALL': remove_notices_all,
         'DEBUG': set_logging_level,
+        'SET_UNITS': set_units_cmd,
     }
     # Current conditions
-    drivers = [
-            {'driver': 'ST', 'value': 1, 'uom': 2},
-            {'driver': 'CLITEMP', 'value': 0, 'uom': 17}, # temperature
-            {'driver': 'CLIHUM', 'value': 0, 'uom': 22},  # humidity
-            {'driver': 'DEWPT', 'value': 0, 'uom': 17},   # dewpoint
-            {'driver': 'GV3', 'value': 0, 'uom': 17},     # heat index
-            {'driver': 'GV4', 'value': 0, 'uom': 17},     # windchill
-            {'driver': 'BARPRES', 'value': 0, 'uom': 23}, # pressure
-            {'driver': 'WINDDIR', 'value': 0, 'uom': 76}, # wind dir
-            {'driver': 'SPEED', 'value': 0, 'uom': 48},   # wind speed
-            {'driver': 'GV16', 'value': 0, 'uom': 25},    # pressure trend
-            {'driver': 'SOLRAD', 'value': 0, 'uom': 74},  # solar radiation
-            ]
+    drivers = schema.drivers('WeatherLink')
 
 
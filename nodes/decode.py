@@ -0,0 +1,147 @@
+#
+#  Selective decoding of the NoaaExt.json payload.
+#
+#  The payload has around 200 values, as strings, and most of them
+#  (image, credit, the *_string and *_time entries, indoor values...)
+#  are never used.  The decoder keeps only the keys listed in the
+#  extraction, extremes and history tables and converts the numeric
+#  values to floats once, into an Observation record (see
+#  observation.py), so nothing later in the poll needs to call float()
+#  or skip over unused keys.
+#
+#  orjson is used to parse the body when it is installed, otherwise the
+#  standard json module is used.  Values that aren't numbers (blank or
+#  '--') are dropped, which the consumers treat the same as a missing
+#  value.
+
+import json
+from nodes import extract
+from nodes import extremes
+from nodes import history
+from nodes import observation
+
+try:
+    import orjson
+    loads = orjson.loads
+    BACKEND = 'orjson'
+except ImportError:
+    loads = json.loads
+    BACKEND = 'json'
+
+SECTION = observation.SECTION
+
+# Values that are kept as strings
+TEXT = {
+        None: ('observation_time_rfc822', 'station_id'),
+        SECTION: ('DID', 'pressure_tendency_string'),
+        }
+
+# Numeric values needed that aren't in the tables
+NUMERIC = {
+        None: (),
+        SECTION: ('observation_age',),
+        }
+
+
+"""
+    Build the {section: {key: is numeric}} table of the values used by
+    the node mappings.
+"""
+def payload_keys():
+    keys = {None: {}, SECTION: {}}
+
+    for section in TEXT:
+        for key in TEXT[section]:
+            keys[section][key] = False
+    for section in NUMERIC:
+        for key in NUMERIC[section]:
+            keys[section][key] = True
+
+    for (driver, section, key, quantity) in extract.CURRENT:
+        keys[section].setdefault(key, quantity != 'trend')
+    for (driver, source, quantity, periods) in extract.OBSERVATIONS:
+        for period in periods:
+            keys[SECTION].setdefault(source.format(p=period), True)
+    for field in extremes.SOURCES:
+        (section, key, quantity) = extremes.SOURCES[field]
+        keys[section].setdefault(key, True)
+    for field in history.FIELDS:
+        (section, key) = history.FIELDS[field]
+        keys[section].setdefault(key, True)
+
+    return keys
+
+
+def layout(keys):
+    numeric = []
+    text = []
+    for section in (None, SECTION):
+        for key in keys[section]:
+            if keys[section][key]:
+                numeric.append((section, key))
+            else:
+                text.append((section, key))
+    return observation.Layout(numeric, text)
+
+
+# Shared by all the observations so they can be merged
+LAYOUT = layout(payload_keys())
+
+
+class Decoder:
+    def __init__(self, keys=None):
+        self.layout = LAYOUT if keys is None else layout(keys)
+        # (text keys, numeric keys) with their record index, per section
+        self.top = self.split(None)
+        self.section = self.split(SECTION)
+
+    def split(self, section):
+        text = tuple((k, i) for (i, (s, k)) in enumerate(self.layout.text) if s == section)
+        numeric = tuple((k, i) for (i, (s, k)) in enumerate(self.layout.numeric) if s == section)
+        return (text, numeric)
+
+    def select(self, source, table, obs):
+        (text, numeric) = table
+        get = source.get
+        for (key, i) in text:
+            value = get(key)
+            if value is not None:
+                obs.text[i] = value
+        values = obs.values
+        mask = obs.mask
+        for (key, i) in numeric:
+            value = get(key)
+            if value is None:
+                continue
+            try:
+                values[i] = float(value)
+                mask[i] = 1
+            except (TypeError, ValueError):
+                continue
+
+    """
+        Decode the response body and return an Observation with only
+        the values used.
+    """
+    def decode(self, body):
+        return self.observation(loads(body))
+
+    # Convert a payload (already parsed) to an Observation
+    def observation(self, data):
+        obs = observation.Observation(self.layout)
+        self.select(data, self.top, obs)
+        section = data.get(SECTION)
+        if isinstance(section, dict):
+            self.select(section, self.section, obs)
+        return obs
+
+
+DECODER = Decoder()
+
+
+"""
+    Convert a payload in the NoaaExt layout, i.e. from the WeatherLink
+    Live or v2 API, to an Observation.
+"""
+def from_payload(payload):
+    return DECODER.observation(payload)
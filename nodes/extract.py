@@ -0,0 +1,97 @@
+#
+#  Table driven extraction of the observations.
+#
+#  CURRENT maps the payload's current conditions to the controller (or
+#  station) node drivers.  OBSERVATIONS maps the day, month and year
+#  values in davis_current_observation, which only differ by the period
+#  name, to the period node drivers.
+#
+#  Both tables are built from the node schema (see schema.py) and are
+#  compiled once for each unit configuration into plans that hold the
+#  converter, precision and UOM for each driver (see uom.QUANTITIES).  A single pass over the payload then produces the
+#  converted driver updates for all of the period nodes.
+
+import functools
+from nodes import uom
+from nodes import schema
+
+PERIODS = schema.PERIODS
+
+SECTION = schema.SECTION
+
+# (driver, section, source key, quantity)
+# Section None is the top level of the payload.
+CURRENT = schema.current_sources()
+
+# (driver, source key, quantity, periods)
+# '{p}' in the source key is replaced with the period name.
+OBSERVATIONS = schema.period_sources()
+
+
+"""
+    Return the current conditions plan for a unit configuration, a
+    tuple of (driver, section, source key, converter, precision).
+"""
+@functools.lru_cache(maxsize=None)
+def current_plan(units):
+    system = uom.unit_system(units)
+    plan = []
+    for (driver, section, key, quantity) in CURRENT:
+        (convert, prec, unit) = uom.conversion(quantity, system)
+        plan.append((driver, section, key, convert, prec))
+    return tuple(plan)
+
+
+"""
+    Apply a current conditions plan to the observation and return the
+    list of (driver, value, precision) updates.
+"""
+def current_conditions(plan, obs):
+    updates = []
+    for (driver, section, key, convert, prec) in plan:
+        value = obs.get(section, key)
+        if value is None:
+            continue
+        try:
+            updates.append((driver, convert(value), prec))
+        except (TypeError, ValueError):
+            continue
+    return updates
+
+
+class Extractor:
+    def __init__(self, units='us', observations=OBSERVATIONS, periods=PERIODS):
+        self.units = units
+        self.periods = periods
+        self.table = {}
+
+        system = uom.unit_system(units)
+        for (driver, source, quantity, used) in observations:
+            (convert, prec, unit) = uom.conversion(quantity, system)
+            for period in used:
+                if period not in periods:
+                    continue
+                key = source.format(p=period)
+                self.table.setdefault(key, []).append((period, driver, convert, prec))
+
+    """
+        Look up each period value in the observation once and return a
+        dictionary, keyed by period, of (driver, value, precision) lists.
+    """
+    def extract(self, obs):
+        updates = {}
+        for period in self.periods:
+            updates[period] = []
+
+        table = self.table
+        for key in table:
+            value = obs.get(SECTION, key)
+            if value is None:
+                continue
+            for (period, driver, convert, prec) in table[key]:
+                try:
+                    updates[period].append((driver, convert(value), prec))
+                except (TypeError, ValueError):
+                    continue
+
+        return updates
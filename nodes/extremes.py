@@ -0,0 +1,217 @@
+#
+#  Local day, month and year extremes.
+#
+#  The day/month/year values in the NoaaExt payload are only available
+#  in US units and are sometimes missing.  This keeps running
+#  min/max/total values for each calendar period, calculated from the
+#  current conditions, to use in their place.
+#
+#  The values are kept in the payload's (US) units and converted to the
+#  configured units when published, so the unit configuration can be
+#  changed without losing them.
+#
+#  Periods follow the station's local time (taken from the UTC offset in
+#  the observation time) and reset when the day, month or year changes.
+#  Payloads that are built locally (WeatherLink Live and v2) format the
+#  observation time in the station's time zone, see observation_time().
+#  Each update is O(1).  The state can be saved to and restored from a
+#  dictionary so it survives restarts.
+#
+#  Rain for the day is the station's daily rain counter.  Month and year
+#  rain are the sum of the increases in that counter, so they only cover
+#  the time the node server has been running.
+
+import re
+import datetime
+from email.utils import formatdate, format_datetime, parsedate_to_datetime
+from nodes import uom
+
+try:
+    from zoneinfo import ZoneInfo
+except ImportError:
+    ZoneInfo = None
+
+PERIODS = ('day', 'month', 'year')
+
+# field : (section, payload key, quantity)
+# The values are converted using the uom.QUANTITIES entry for the
+# configured unit system.
+SOURCES = {
+    'temp': (None, 'temp_f', 'temperature'),
+    'dewpoint': (None, 'dewpoint_f', 'temperature'),
+    'heat_index': (None, 'heat_index_f', 'temperature'),
+    'windchill': (None, 'windchill_f', 'temperature'),
+    'humidity': (None, 'relative_humidity', 'humidity'),
+    'pressure': (None, 'pressure_in', 'pressure'),
+    'wind_speed': (None, 'wind_mph', 'speed'),
+    'wind_gust': ('davis_current_observation', 'wind_ten_min_gust_mph', 'speed'),
+    'rain': ('davis_current_observation', 'rain_day_in', 'rain'),
+    'rain_rate': ('davis_current_observation', 'rain_rate_in_per_hr', 'rain_rate'),
+    'solar_radiation': ('davis_current_observation', 'solar_radiation', 'solar'),
+    'uv_index': ('davis_current_observation', 'uv_index', 'uv'),
+    }
+
+# (driver, field, statistic, periods)
+STATS = (
+        ('GV0', 'temp', 'max', PERIODS),
+        ('GV1', 'temp', 'min', PERIODS),
+        ('GV2', 'dewpoint', 'max', PERIODS),
+        ('GV3', 'dewpoint', 'min', PERIODS),
+        ('GV4', 'heat_index', 'max', PERIODS),
+        ('GV5', 'windchill', 'min', PERIODS),
+        ('GV8', 'humidity', 'max', PERIODS),
+        ('GV9', 'humidity', 'min', PERIODS),
+        ('GV10', 'pressure', 'max', PERIODS),
+        ('GV11', 'pressure', 'min', PERIODS),
+        ('GV12', 'rain', 'sum', PERIODS),
+        ('RAINRT', 'rain_rate', 'max', PERIODS),
+        ('SPEED', 'wind_speed', 'max', PERIODS),
+        ('GV13', 'wind_gust', 'last', ('day',)),
+        ('SOLRAD', 'solar_radiation', 'max', PERIODS),
+        ('UV', 'uv_index', 'max', PERIODS),
+        )
+
+STAT_INDEX = {'min': 0, 'max': 1, 'sum': 2, 'last': 3}
+# units the values are kept in
+STORAGE_UNITS = 'us'
+
+
+def unit_system(units):
+    return uom.unit_system(units)
+
+
+"""
+    Pull the current condition values out of the observation, in US
+    units.
+"""
+def local_values(obs):
+    values = {}
+    for field in SOURCES:
+        (section, key, quantity) = SOURCES[field]
+        value = obs.get(section, key)
+        if value is not None:
+            values[field] = value
+    return values
+
+
+# The observation time in the station's local time.
+def local_time(obs):
+    try:
+        return parsedate_to_datetime(obs.get(None, 'observation_time_rfc822'))
+    except (TypeError, ValueError):
+        return datetime.datetime.now()
+
+
+"""
+    Return the tzinfo for a station from its time zone name (i.e.
+    'Europe/Rome') or, when the name can't be used, its UTC offset (i.e.
+    '+0200 CEST').  The offset doesn't follow daylight saving changes
+    until it's updated.  Returns None when neither is known.
+"""
+def station_zone(name=None, offset=None):
+    if name and ZoneInfo is not None:
+        try:
+            return ZoneInfo(name)
+        except (KeyError, ValueError):
+            pass
+    match = re.match(r'\s*([+-])(\d\d):?(\d\d)', offset or '')
+    if match is None:
+        return None
+    minutes = int(match.group(2)) * 60 + int(match.group(3))
+    if match.group(1) == '-':
+        minutes = -minutes
+    return datetime.timezone(datetime.timedelta(minutes=minutes))
+
+
+# Format a unix time as an RFC 822 observation time in the station's
+# time zone, or the host's when it isn't known.
+def observation_time(ts, zone=None):
+    if zone is None:
+        return formatdate(ts, localtime=True)
+    return format_datetime(datetime.datetime.fromtimestamp(ts, zone))
+
+
+def period_keys(when):
+    return {
+        'day': when.strftime('%Y-%m-%d'),
+        'month': when.strftime('%Y-%m'),
+        'year': when.strftime('%Y'),
+        }
+
+
+class Extremes:
+    def __init__(self, units='us'):
+        # units the values are published in
+        self.units = unit_system(units)
+        self.rain_counter = None
+        # period : {'key': period key, 'stats': {field: [min, max, sum, last]}}
+        self.periods = {}
+        for period in PERIODS:
+            self.periods[period] = {'key': None, 'stats': {}}
+
+    def update(self, values, when):
+        keys = period_keys(when)
+
+        # rain increment from the station's daily counter
+        rain = values.get('rain')
+        increment = 0
+        if rain is not None:
+            if self.rain_counter is not None:
+                increment = rain - self.rain_counter if rain >= self.rain_counter else rain
+            self.rain_counter = rain
+
+        for period in PERIODS:
+            state = self.periods[period]
+            if state['key'] != keys[period]:
+                state['key'] = keys[period]
+                state['stats'] = {}
+            stats = state['stats']
+
+            for field in values:
+                v = values[field]
+                s = stats.get(field)
+                if s is None:
+                    stats[field] = [v, v, 0, v]
+                    s = stats[field]
+                else:
+                    if v < s[0]:
+                        s[0] = v
+                    if v > s[1]:
+                        s[1] = v
+                    s[3] = v
+
+            if rain is not None:
+                if period == 'day':
+                    stats['rain'][2] = rain
+                else:
+                    stats['rain'][2] += increment
+
+    """
+        Return the (driver, value, precision) list for a period node,
+        in the configured units.
+    """
+    def updates(self, period):
+        stats = self.periods[period]['stats']
+        updates = []
+        for (driver, field, stat, used) in STATS:
+            if period not in used or field not in stats:
+                continue
+            (convert, prec, unit) = uom.conversion(SOURCES[field][2], self.units)
+            updates.append((driver, convert(stats[field][STAT_INDEX[stat]]), prec))
+        return updates
+
+    def to_dict(self):
+        return {
+                'units': STORAGE_UNITS,
+                'rain_counter': self.rain_counter,
+                'periods': self.periods,
+                }
+
+    def from_dict(self, data):
+        # values saved in other units can't be used
+        if data.get('units') != STORAGE_UNITS:
+            return
+        self.rain_counter = data.get('rain_counter')
+        for period in PERIODS:
+            if period in data.get('periods', {}):
+                self.periods[period] = data['periods'][period]
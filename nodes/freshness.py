@@ -0,0 +1,102 @@
+#
+#  End to end freshness of the published values.
+#
+#  Each new observation is timed at every stage on its way to the ISY:
+#
+#     observed   - when the station made the observation
+#     requested  - when the request that returned it was sent
+#     received   - when the response was received and decoded
+#     published  - when the last driver update for it was sent
+#
+#  The WeatherLink API doesn't say when an observation became available
+#  in the cloud, so the upload stage (observed to requested) covers the
+#  console's upload, the cloud and the wait for our next poll.  Each
+#  stage goes into a metrics histogram and the end to end latencies of
+#  the last WINDOW observations are kept for rolling percentiles.
+#
+#  The data age is how old the newest observation published is right
+#  now, for the station that is furthest behind.  When it passes the
+#  stale threshold the controller's ST driver shows STALE.
+
+import collections
+import threading
+import polyinterface
+
+LOGGER = polyinterface.LOGGER
+
+# Observations kept for the rolling percentiles
+WINDOW = 100
+# Default stale threshold, seconds
+DEFAULT_STALE_AGE = 1800
+# ST value when the data is stale, after the resilience breaker states
+STALE = 3
+
+
+class Freshness:
+    def __init__(self, metrics, window=WINDOW):
+        self.metrics = metrics
+        self.latencies = collections.deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    """
+        Record the stage times (unix seconds) of an observation.  Stages
+        that aren't known (None) are skipped.
+    """
+    def record(self, observed, requested, received, published):
+        if observed is None:
+            return
+        if requested is not None:
+            self.metrics.observe('freshness_upload_seconds', max(0.0, requested - observed))
+        if received is not None:
+            self.metrics.observe('freshness_publish_seconds', max(0.0, published - received))
+        latency = max(0.0, published - observed)
+        self.metrics.observe('freshness_latency_seconds', latency)
+        with self.lock:
+            self.latencies.append(latency)
+
+    # The q quantile (0 to 1) of the recent end to end latencies
+    def percentile(self, q):
+        with self.lock:
+            values = sorted(self.latencies)
+        if len(values) == 0:
+            return None
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+    """
+        Return the age of the oldest data published for the stations, or
+        None when nothing has been published yet.
+    """
+    def data_age(self, stations, now):
+        age = None
+        for st in stations:
+            if st.observed is None:
+                continue
+            if age is None or now - st.observed > age:
+                age = max(0.0, now - st.observed)
+        return age
+
+    # Update the gauges for the metrics file
+    def update_metrics(self, age):
+        if age is not None:
+            self.metrics.set('data_age_seconds', age)
+        for (name, q) in (('freshness_latency_p50_seconds', 0.5), ('freshness_latency_p95_seconds', 0.95)):
+            value = self.percentile(q)
+            if value is not None:
+                self.metrics.set(name, value)
+
+
+# Is the data older than the stale threshold?  A threshold of 0 (or
+# less) disables the check.
+def is_stale(age, threshold):
+    return threshold > 0 and age is not None and age > threshold
+
+
+def to_threshold(value, default=DEFAULT_STALE_AGE, name='stale age'):
+    try:
+        threshold = float(value)
+        if threshold >= 0:
+            return threshold
+    except (TypeError, ValueError):
+        pass
+    LOGGER.warning('Invalid {} {}, using {}'.format(name, value, default))
+    return default
@@ -0,0 +1,249 @@
+#
+#  Local time-series store for the observations polled.
+#
+#  Each new observation is recorded in a SQLite database (WAL mode) so
+#  that history can be read locally instead of asking the WeatherLink
+#  API again.  Data is kept in three tiers:
+#
+#     raw   - every observation, kept 2 days
+#     min5  - 5 minute aggregates, kept 30 days
+#     hour  - hourly aggregates, kept 2 years
+#
+#  Every tier has the same layout, (station, field, ts, n, sum, min,
+#  max), raw rows have n = 1.  Values are stored in the units the API
+#  sends them (US units).  Wind direction is stored as the components
+#  of a unit vector (see VECTORS) so its aggregates are vector averages.
+#
+#  Inserts are buffered and written in one transaction when the buffer
+#  fills or maintain() is called (from longPoll).  maintain() also rolls
+#  completed buckets up into the next tier and drops expired rows.
+
+import math
+import time
+import sqlite3
+import threading
+import polyinterface
+
+LOGGER = polyinterface.LOGGER
+
+# field name : (section, payload key).  Section None is the top level
+# of the payload, otherwise the named sub-dictionary.
+FIELDS = {
+        'temp': (None, 'temp_f'),
+        'dewpoint': (None, 'dewpoint_f'),
+        'heat_index': (None, 'heat_index_f'),
+        'windchill': (None, 'windchill_f'),
+        'humidity': (None, 'relative_humidity'),
+        'pressure': (None, 'pressure_in'),
+        'wind_speed': (None, 'wind_mph'),
+        'wind_dir': (None, 'wind_degrees'),
+        'solar_radiation': ('davis_current_observation', 'solar_radiation'),
+        'uv_index': ('davis_current_observation', 'uv_index'),
+        'rain_rate': ('davis_current_observation', 'rain_rate_in_per_hr'),
+        'rain_day': ('davis_current_observation', 'rain_day_in'),
+        }
+
+# Directions can't be averaged as numbers (350 and 10 degrees would
+# average to 180), they are stored as the east and north components of
+# a unit vector instead.  Summing those in the rollups gives the vector
+# average.  field name : (east field, north field)
+VECTORS = {
+        'wind_dir': ('wind_dir_east', 'wind_dir_north'),
+        }
+
+# (table, bucket size, retention)
+TIERS = (
+        ('raw', 0, 2 * 86400),
+        ('min5', 300, 30 * 86400),
+        ('hour', 3600, 2 * 365 * 86400),
+        )
+
+BATCH_SIZE = 500
+
+
+def extract_fields(obs):
+    values = {}
+    for field in FIELDS:
+        (section, key) = FIELDS[field]
+        value = obs.get(section, key)
+        if value is not None:
+            values[field] = value
+    return values
+
+
+class History:
+    def __init__(self, path, batch_size=BATCH_SIZE):
+        self.path = path
+        self.batch_size = batch_size
+        self.db = None
+        self.pending = []
+        self.lock = threading.Lock()
+
+    def open(self):
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        for (table, bucket, retention) in TIERS:
+            self.db.execute('CREATE TABLE IF NOT EXISTS {} ('
+                    'station TEXT NOT NULL, field TEXT NOT NULL, '
+                    'ts INTEGER NOT NULL, n INTEGER NOT NULL, '
+                    'sum REAL NOT NULL, min REAL NOT NULL, max REAL NOT NULL, '
+                    'PRIMARY KEY (station, field, ts)) WITHOUT ROWID'.format(table))
+            self.db.execute('CREATE INDEX IF NOT EXISTS {0}_ts ON {0} (ts)'.format(table))
+        # how far each tier has been rolled up
+        self.db.execute('CREATE TABLE IF NOT EXISTS rollup ('
+                'tier TEXT PRIMARY KEY, ts INTEGER NOT NULL)')
+        self.db.commit()
+        LOGGER.info('Recording observation history to ' + self.path)
+
+    def close(self):
+        if self.db is not None:
+            self.flush()
+            self.db.close()
+            self.db = None
+
+    def record(self, station, ts, obs):
+        values = extract_fields(obs)
+        ts = int(ts)
+        with self.lock:
+            for field in values:
+                v = values[field]
+                if field in VECTORS:
+                    (east, north) = VECTORS[field]
+                    for (name, c) in ((east, math.sin(math.radians(v))), (north, math.cos(math.radians(v)))):
+                        self.pending.append((station, name, ts, 1, c, c, c))
+                    continue
+                self.pending.append((station, field, ts, 1, v, v, v))
+            full = len(self.pending) >= self.batch_size
+
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            if self.db is None or len(self.pending) == 0:
+                return
+            rows = self.pending
+            self.pending = []
+            try:
+                with self.db:
+                    self.db.executemany('INSERT OR REPLACE INTO raw VALUES '
+                            '(?, ?, ?, ?, ?, ?, ?)', rows)
+            except sqlite3.Error as e:
+                LOGGER.error('Failed to write history: ' + str(e))
+
+    """
+        Write pending rows, roll up completed buckets into the 5 minute
+        and hourly tiers and remove expired rows.
+    """
+    def maintain(self, now=None):
+        if now is None:
+            now = time.time()
+        self.flush()
+
+        with self.lock:
+            if self.db is None:
+                return
+            try:
+                with self.db:
+                    for i in range(1, len(TIERS)):
+                        self.rollup(TIERS[i - 1][0], TIERS[i][0], TIERS[i][1], now)
+                    for (table, bucket, retention) in TIERS:
+                        self.db.execute('DELETE FROM {} WHERE ts < ?'.format(table),
+                                (int(now - retention),))
+            except sqlite3.Error as e:
+                LOGGER.error('History maintenance failed: ' + str(e))
+
+    # Aggregate the completed buckets of source into target.  Buckets
+    # are recomputed for a while after they complete, observations can
+    # arrive a few minutes after they were made.
+    def rollup(self, source, target, bucket, now):
+        row = self.db.execute('SELECT ts FROM rollup WHERE tier = ?', (target,)).fetchone()
+        start = row[0] - max(3600, 2 * bucket) if row is not None else 0
+        end = int(now // bucket) * bucket
+        if end <= start:
+            return
+
+        self.db.execute('INSERT OR REPLACE INTO {0} '
+                'SELECT station, field, (ts / {1}) * {1} AS bucket, '
+                'SUM(n), SUM(sum), MIN(min), MAX(max) FROM {2} '
+                'WHERE ts >= ? AND ts < ? GROUP BY station, field, bucket'.format(
+                    target, bucket, source), (start, end))
+        self.db.execute('INSERT OR REPLACE INTO rollup VALUES (?, ?)', (target, end))
+
+    def tier_for(self, start, end):
+        now = time.time()
+        for (table, bucket, retention) in TIERS:
+            if start >= now - retention:
+                return table
+        return TIERS[-1][0]
+
+    """
+        Return a list of (ts, average, min, max) for a field between
+        start and end.  The tier is picked from the time span unless
+        one is given.
+    """
+    def range(self, station, field, start, end, tier=None):
+        self.flush()
+        if tier is None:
+            tier = self.tier_for(start, end)
+        if field in VECTORS:
+            return self.vector_range(station, field, start, end, tier)
+        with self.lock:
+            rows = self.db.execute('SELECT ts, sum / n, min, max FROM {} '
+                    'WHERE station = ? AND field = ? AND ts >= ? AND ts < ? '
+                    'ORDER BY ts'.format(tier),
+                    (station, field, int(start), int(end))).fetchall()
+        return rows
+
+    """
+        Return (count, average, min, max) for a field between start and
+        end, or None if there is no data.
+    """
+    def aggregate(self, station, field, start, end, tier=None):
+        self.flush()
+        if tier is None:
+            tier = self.tier_for(start, end)
+        if field in VECTORS:
+            return self.vector_aggregate(station, field, start, end, tier)
+        with self.lock:
+            row = self.db.execute('SELECT SUM(n), SUM(sum), MIN(min), MAX(max) '
+                    'FROM {} WHERE station = ? AND field = ? AND ts >= ? '
+                    'AND ts < ?'.format(tier),
+                    (station, field, int(start), int(end))).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return (row[0], row[1] / row[0], row[2], row[3])
+
+    """
+        range() for a direction.  The average is the direction of the
+        summed unit vectors, min and max are None.
+    """
+    def vector_range(self, station, field, start, end, tier):
+        (east, north) = VECTORS[field]
+        with self.lock:
+            rows = self.db.execute('SELECT e.ts, e.sum, n.sum FROM {0} e '
+                    'JOIN {0} n ON n.station = e.station AND n.ts = e.ts AND n.field = ? '
+                    'WHERE e.station = ? AND e.field = ? AND e.ts >= ? AND e.ts < ? '
+                    'ORDER BY e.ts'.format(tier),
+                    (north, station, east, int(start), int(end))).fetchall()
+        return [(ts, direction(x, y), None, None) for (ts, x, y) in rows]
+
+    def vector_aggregate(self, station, field, start, end, tier):
+        (east, north) = VECTORS[field]
+        with self.lock:
+            rows = self.db.execute('SELECT field, SUM(n), SUM(sum) FROM {} '
+                    'WHERE station = ? AND field IN (?, ?) AND ts >= ? '
+                    'AND ts < ? GROUP BY field'.format(tier),
+                    (station, east, north, int(start), int(end))).fetchall()
+        sums = dict((row[0], row[1:]) for row in rows)
+        if east not in sums or north not in sums:
+            return None
+        return (sums[east][0], direction(sums[east][1], sums[north][1]), None, None)
+
+
+# Direction (degrees) of a vector, None when it has no length
+def direction(east, north):
+    if abs(east) < 1e-9 and abs(north) < 1e-9:
+        return None
+    return round(math.degrees(math.atan2(east, north)), 1) % 360
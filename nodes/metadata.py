@@ -0,0 +1,104 @@
+#
+#  Station metadata from the StationStatus.json endpoint.
+#
+#  The metadata is fetched when the node server starts and then only
+#  every METADATA_TTL seconds.  It is cached in memory and in
+#  METADATA_FILE so restarts don't need to fetch it again.
+#
+#  The metadata is used to:
+#    - set the poll cadence for stations that only upload archive
+#      records (station_archive_interval)
+#    - stop fetching NoaaExt.json while the console is offline
+#      (station_last_active_unix).  While offline the metadata is
+#      checked every OFFLINE_TTL seconds instead.
+#    - find the station's time zone (station_timezone and
+#      station_time_offset) for the payloads that are built locally.
+
+from nodes import extremes
+
+METADATA_FILE = 'station_status.json'
+METADATA_TTL = 6 * 3600
+OFFLINE_TTL = 300
+RETRY_TTL = 600
+# the console is considered offline when it hasn't been active for
+# this many archive intervals
+OFFLINE_INTERVALS = 3
+# loop data older than this means the console only uploads archives
+LOOP_STALE = 900
+
+
+def to_int(value, default=None):
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return default
+
+
+class StationMetadata:
+    def __init__(self):
+        self.data = None
+        self.fetched = 0
+        self.next_refresh = 0
+        self.offline = False
+
+    def needs_refresh(self, now):
+        return now >= self.next_refresh
+
+    # Archive interval in seconds or None
+    @property
+    def archive_interval(self):
+        if self.data is None:
+            return None
+        minutes = to_int(self.data.get('station_archive_interval'))
+        if minutes is None or minutes <= 0:
+            return None
+        return minutes * 60
+
+    """
+        Does the console upload loop (current) data continuously, or
+        only archive records?
+    """
+    def uploads_loop(self):
+        if self.data is None:
+            return True
+        server = to_int(self.data.get('server_time_unix'))
+        loop = to_int(self.data.get('station_last_loop_unix'))
+        if server is None or loop is None:
+            return True
+        return server - loop <= LOOP_STALE
+
+    # The station's tzinfo or None
+    def zone(self):
+        if self.data is None:
+            return None
+        return extremes.station_zone(self.data.get('station_timezone'),
+                self.data.get('station_time_offset'))
+
+    def update(self, data, fetched):
+        self.data = data
+        self.fetched = fetched
+        self.offline = self.is_offline()
+        if self.offline:
+            self.next_refresh = fetched + OFFLINE_TTL
+        else:
+            self.next_refresh = fetched + METADATA_TTL
+
+    def failed(self, now):
+        self.next_refresh = now + RETRY_TTL
+
+    def is_offline(self):
+        server = to_int(self.data.get('server_time_unix'))
+        active = to_int(self.data.get('station_last_active_unix'))
+        if server is None or active is None:
+            return False
+        interval = self.archive_interval or 0
+        limit = max(OFFLINE_INTERVALS * interval, 900)
+        return server - active > limit
+
+    def to_dict(self):
+        return {'fetched': self.fetched, 'data': self.data}
+
+    def from_dict(self, saved):
+        if saved is None or saved.get('data') is None:
+            return
+        self.update(saved['data'], saved.get('fetched', 0))
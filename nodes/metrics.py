@@ -0,0 +1,226 @@
+#
+#  Instrumentation of the poll path.
+#
+#  Timings and sizes are kept in fixed-size histograms (Prometheus
+#  style buckets), so memory use doesn't grow with the number of polls.
+#  Counters and gauges are kept along side them.  Each metric can have
+#  labels, i.e. the node or station it is for.
+#
+#  The full set can be written to a file, either in the Prometheus text
+#  format or, when the file name ends in .json, as JSON.
+#
+#  The fetch and publish threads both record metrics, so all access is
+#  done holding the lock.
+
+import bisect
+import threading
+import time
+import node_funcs
+
+PREFIX = 'weatherlink_'
+
+SECONDS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# observation ages, from a few seconds (WeatherLink Live) to the slowest
+# cloud upload intervals
+AGES = (1, 2.5, 5, 10, 30, 60, 120, 300, 600, 900, 1800, 3600)
+BYTES = (1024, 2048, 4096, 8192, 16384, 32768, 65536, 131072)
+
+# name : (type, help, histogram buckets)
+DEFINITIONS = {
+        'fetch_seconds': ('histogram', 'WeatherLink request time', SECONDS),
+        'fetch_bytes': ('histogram', 'WeatherLink response size', BYTES),
+        'decode_seconds': ('histogram', 'Response decode time', SECONDS),
+        'parse_seconds': ('histogram', 'Time to parse and publish the values for a node', SECONDS),
+        'poll_seconds': ('histogram', 'Time to query all the stations that are due', SECONDS),
+        'fetch_failures_total': ('counter', 'Failed WeatherLink requests', None),
+        'consecutive_failures': ('gauge', 'Failed requests since the last success', None),
+        'driver_updates_sent_total': ('counter', 'Driver updates sent to the ISY', None),
+        'driver_updates_suppressed_total': ('counter', 'Driver updates suppressed by the deadbands', None),
+        'driver_updates_coalesced_total': ('counter', 'Driver updates replaced by a later one before they were sent', None),
+        'publish_flush_seconds': ('histogram', 'Time to send the driver updates batched in a publish cycle', SECONDS),
+        'freshness_upload_seconds': ('histogram', 'Observation time to the request that returned it', AGES),
+        'freshness_publish_seconds': ('histogram', 'Response received to the last driver update', SECONDS),
+        'freshness_latency_seconds': ('histogram', 'Observation time to the last driver update', AGES),
+        'freshness_latency_p50_seconds': ('gauge', 'Median latency of the recent observations', None),
+        'freshness_latency_p95_seconds': ('gauge', '95th percentile latency of the recent observations', None),
+        'data_age_seconds': ('gauge', 'Age of the oldest station data published', None),
+        }
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # the last count is for values above the largest bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.last = None
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.last = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    """
+        Estimate a quantile by interpolating within the bucket it falls
+        in.  Values above the largest bucket use the maximum seen.
+    """
+    def quantile(self, q):
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for i in range(len(self.counts)):
+            if self.counts[i] == 0 or cumulative + self.counts[i] < rank:
+                cumulative += self.counts[i]
+                continue
+            lower = self.buckets[i - 1] if i > 0 else 0
+            upper = self.buckets[i] if i < len(self.buckets) else self.max
+            return lower + (upper - lower) * (rank - cumulative) / self.counts[i]
+        return self.max
+
+    def to_dict(self):
+        buckets = {}
+        cumulative = 0
+        for i in range(len(self.buckets)):
+            cumulative += self.counts[i]
+            buckets[str(self.buckets[i])] = cumulative
+        buckets['+Inf'] = self.count
+        return {
+                'buckets': buckets,
+                'count': self.count,
+                'sum': self.sum,
+                'last': self.last,
+                'max': self.max,
+                'p50': self.quantile(0.5),
+                'p95': self.quantile(0.95),
+                }
+
+
+class Timer:
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.start, self.labels)
+        return False
+
+
+def label_key(labels):
+    if labels is None:
+        return ()
+    return tuple(sorted(labels.items()))
+
+
+def format_labels(key, extra=None):
+    pairs = list(key)
+    if extra is not None:
+        pairs.append(extra)
+    if len(pairs) == 0:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, v) for (k, v) in pairs) + '}'
+
+
+class Metrics:
+    def __init__(self, definitions=DEFINITIONS):
+        self.definitions = definitions
+        self.lock = threading.Lock()
+        # name : {label key : Histogram or value}
+        self.values = {}
+        for name in definitions:
+            self.values[name] = {}
+
+    def observe(self, name, value, labels=None):
+        key = label_key(labels)
+        with self.lock:
+            series = self.values[name]
+            if key not in series:
+                series[key] = Histogram(self.definitions[name][2])
+            series[key].observe(value)
+
+    def timer(self, name, labels=None):
+        return Timer(self, name, labels)
+
+    def inc(self, name, amount=1, labels=None):
+        key = label_key(labels)
+        with self.lock:
+            series = self.values[name]
+            series[key] = series.get(key, 0) + amount
+
+    def set(self, name, value, labels=None):
+        with self.lock:
+            self.values[name][label_key(labels)] = value
+
+    """
+        Return a value, summed over all labels.  For histograms, return
+        the requested quantile over all labels (only valid when there is
+        just one set of labels).
+    """
+    def value(self, name, quantile=None):
+        with self.lock:
+            series = self.values[name]
+            if quantile is None:
+                return sum(series.values())
+            for key in series:
+                return series[key].quantile(quantile)
+            return None
+
+    def maximum(self, name):
+        with self.lock:
+            series = self.values[name]
+            if len(series) == 0:
+                return 0
+            return max(series.values())
+
+    def to_dict(self):
+        data = {}
+        with self.lock:
+            for name in self.definitions:
+                series = []
+                for key in self.values[name]:
+                    value = self.values[name][key]
+                    if isinstance(value, Histogram):
+                        value = value.to_dict()
+                    series.append({'labels': dict(key), 'value': value})
+                data[PREFIX + name] = series
+        return data
+
+    def to_prometheus(self):
+        lines = []
+        with self.lock:
+            for name in self.definitions:
+                (kind, text, buckets) = self.definitions[name]
+                full = PREFIX + name
+                lines.append('# HELP {} {}'.format(full, text))
+                lines.append('# TYPE {} {}'.format(full, kind))
+                for key in self.values[name]:
+                    value = self.values[name][key]
+                    if kind != 'histogram':
+                        lines.append('{}{} {}'.format(full, format_labels(key), value))
+                        continue
+                    cumulative = 0
+                    for i in range(len(value.buckets)):
+                        cumulative += value.counts[i]
+                        lines.append('{}_bucket{} {}'.format(full,
+                            format_labels(key, ('le', value.buckets[i])), cumulative))
+                    lines.append('{}_bucket{} {}'.format(full,
+                        format_labels(key, ('le', '+Inf')), value.count))
+                    lines.append('{}_sum{} {}'.format(full, format_labels(key), value.sum))
+                    lines.append('{}_count{} {}'.format(full, format_labels(key), value.count))
+        return '\n'.join(lines) + '\n'
+
+    def save(self, path):
+        if path.endswith('.json'):
+            node_funcs.save_json(path, self.to_dict())
+        else:
+            node_funcs.save_text(path, self.to_prometheus())
@@ -0,0 +1,110 @@
+#
+#  Compact observation record.
+#
+#  An observation is decoded once per poll into this record and the
+#  same record is used by every node, the local extremes, the rolling
+#  windows and the history.  The numeric values are kept as floats in
+#  an array with a mask of which ones are present, the few text values
+#  (observation time, station id, pressure trend) in a short list.
+#
+#  The layout (which values exist and where they are kept) is shared by
+#  all the records, so a record is three small objects no matter how
+#  many values it holds.  Values are looked up by (section, payload key),
+#  the same names as the NoaaExt payload, section None is the top level
+#  and SECTION is the davis_current_observation section.
+
+from array import array
+
+SECTION = 'davis_current_observation'
+
+
+"""
+    The values an observation holds.  numeric and text are sequences of
+    (section, key) pairs.
+"""
+class Layout:
+    def __init__(self, numeric, text):
+        self.numeric = tuple(numeric)
+        self.text = tuple(text)
+        # (section, key) : (is numeric, index)
+        self.fields = {}
+        for i in range(len(self.numeric)):
+            self.fields[self.numeric[i]] = (True, i)
+        for i in range(len(self.text)):
+            self.fields[self.text[i]] = (False, i)
+        self.zeros = array('d', [0.0] * len(self.numeric))
+
+
+class Observation:
+    __slots__ = ('layout', 'values', 'mask', 'text')
+
+    def __init__(self, layout):
+        self.layout = layout
+        self.values = array('d', layout.zeros)
+        # 1 for each numeric value that is present
+        self.mask = bytearray(len(layout.numeric))
+        self.text = [None] * len(layout.text)
+
+    def get(self, section, key, default=None):
+        field = self.layout.fields.get((section, key))
+        if field is None:
+            return default
+        (numeric, i) = field
+        if numeric:
+            return self.values[i] if self.mask[i] else default
+        value = self.text[i]
+        return default if value is None else value
+
+    """
+        Set a value, converting numeric values to float.  Returns False
+        if the value isn't part of the layout or isn't a number.
+    """
+    def set(self, section, key, value):
+        field = self.layout.fields.get((section, key))
+        if field is None or value is None:
+            return False
+        (numeric, i) = field
+        if not numeric:
+            self.text[i] = value
+            return True
+        try:
+            self.values[i] = float(value)
+        except (TypeError, ValueError):
+            return False
+        self.mask[i] = 1
+        return True
+
+    def has(self, section, key):
+        return self.get(section, key) is not None
+
+    # Return the keys of the numeric values that are missing
+    def missing(self):
+        return [self.layout.numeric[i][1] for i in range(len(self.mask)) if not self.mask[i]]
+
+    """
+        Return a new observation with the values of this one updated by
+        the values present in newer (i.e. a real-time packet).
+    """
+    def merge(self, newer):
+        merged = Observation(self.layout)
+        merged.values = array('d', self.values)
+        merged.mask = bytearray(self.mask)
+        merged.text = list(self.text)
+        for i in range(len(newer.mask)):
+            if newer.mask[i]:
+                merged.values[i] = newer.values[i]
+                merged.mask[i] = 1
+        for i in range(len(newer.text)):
+            if newer.text[i] is not None:
+                merged.text[i] = newer.text[i]
+        return merged
+
+    # The values present, in the NoaaExt payload layout
+    def to_payload(self):
+        payload = {SECTION: {}}
+        for (section, key) in self.layout.fields:
+            value = self.get(section, key)
+            if value is not None:
+                target = payload if section is None else payload[section]
+                target[key] = value
+        return payload
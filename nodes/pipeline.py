@@ -0,0 +1,119 @@
+#
+#  Background fetch pipeline.
+#
+#  Fetching runs on a dedicated thread so that network latency and JSON
+#  decoding never block the Polyglot poll thread.  New observations are
+#  handed to a publisher thread through a latest-wins queue that holds at
+#  most one pending observation per station; if the publisher falls
+#  behind, an older observation is replaced by the newer one instead of
+#  queueing up.
+#
+#  shortPoll only wakes the fetcher.  Between short polls the fetcher
+#  sleeps until the next station upload is expected.
+
+import threading
+import collections
+import polyinterface
+
+LOGGER = polyinterface.LOGGER
+
+
+class LatestQueue:
+    def __init__(self):
+        self.items = collections.OrderedDict()
+        self.cond = threading.Condition()
+        self.dropped = 0
+
+    def put(self, key, item):
+        with self.cond:
+            if key in self.items:
+                del self.items[key]
+                self.dropped += 1
+            self.items[key] = item
+            self.cond.notify()
+
+    # return the oldest (key, item) or None if nothing arrived in time
+    def get(self, timeout=None):
+        with self.cond:
+            if len(self.items) == 0:
+                self.cond.wait(timeout)
+            if len(self.items) == 0:
+                return None
+            return self.items.popitem(last=False)
+
+    def wake(self):
+        with self.cond:
+            self.cond.notify_all()
+
+
+class Pipeline:
+    def __init__(self, control):
+        self.control = control
+        self.queue = LatestQueue()
+        self.wake_event = threading.Event()
+        self.running = False
+        self.fetcher = None
+        self.publisher = None
+
+    def start(self):
+        self.running = True
+        self.check()
+
+    """
+        Make sure the fetcher and publisher threads are running,
+        restarting them if they've died.
+    """
+    def check(self):
+        if not self.running:
+            return
+
+        if self.fetcher is None or not self.fetcher.is_alive():
+            if self.fetcher is not None:
+                LOGGER.error('Fetch thread died, restarting it')
+            self.fetcher = threading.Thread(target=self.fetch_loop, name='WeatherLinkFetch')
+            self.fetcher.daemon = True
+            self.fetcher.start()
+
+        if self.publisher is None or not self.publisher.is_alive():
+            if self.publisher is not None:
+                LOGGER.error('Publish thread died, restarting it')
+            self.publisher = threading.Thread(target=self.publish_loop, name='WeatherLinkPublish')
+            self.publisher.daemon = True
+            self.publisher.start()
+
+    # Ask the fetcher to check for stations that are due.
+    def wake(self):
+        self.wake_event.set()
+
+    def stop(self, timeout=None):
+        self.running = False
+        self.wake_event.set()
+        self.queue.wake()
+        for thread in (self.fetcher, self.publisher):
+            if thread is not None and thread is not threading.current_thread():
+                thread.join(timeout)
+
+    def fetch_loop(self):
+        while self.running:
+            self.wake_event.wait(self.control.next_fetch_delay())
+            self.wake_event.clear()
+            if not self.running:
+                break
+
+            try:
+                for (st, jdata) in self.control.fetch_due():
+                    self.queue.put(st.index, (st, jdata, st.last_received))
+            except Exception as e:
+                LOGGER.error('Fetch failed: ' + str(e))
+
+    def publish_loop(self):
+        while self.running:
+            entry = self.queue.get(1.0)
+            if entry is None:
+                continue
+
+            (st, jdata, received) = entry[1]
+            try:
+                self.control.process_fetched(st, jdata, received)
+            except Exception as e:
+                LOGGER.error('Publish failed: ' + str(e))
@@ -0,0 +1,151 @@
+#
+#  Batched driver publishing.
+#
+#  Without batching, every driver update is sent to Polyglot as soon as
+#  it is made, about 60 messages per poll interleaved across the nodes.
+#  During a publish cycle the updates are staged instead, per node, with
+#  a later update to the same driver replacing the earlier one.  When
+#  the cycle ends everything staged is sent in one burst, node by node
+#  in the order the nodes and drivers were first updated.
+#
+#  Cycles are per thread and can nest, the updates are sent when the
+#  outermost cycle ends.  Updates made outside of a cycle, and forced
+#  updates, are sent right away.  A forced update also drops anything
+#  staged for the same driver so an older value can't follow it.
+#
+#  The burst is paced with a token bucket, RATE messages per second
+#  with bursts of up to BURST, so a large flush (i.e. a unit change with
+#  many stations) doesn't flood the ISY.  A normal poll fits in one
+#  burst and isn't delayed.
+
+import time
+import threading
+import collections
+import polyinterface
+
+LOGGER = polyinterface.LOGGER
+
+RATE = 50
+BURST = 100
+
+
+class PublishBuffer:
+    def __init__(self, metrics=None, rate=RATE, burst=BURST):
+        self.metrics = metrics
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.refilled = time.monotonic()
+        self.local = threading.local()
+        # serializes the setDriver calls.  It's only held for a single
+        # send, never while waiting for a token, so updates sent right
+        # away (i.e. the status from shortPoll) don't wait for a paced
+        # burst.
+        self.lock = threading.Lock()
+        self.bucket_lock = threading.Lock()
+
+    def staged(self):
+        nodes = getattr(self.local, 'nodes', None)
+        if nodes is None:
+            # address : (node, {driver : (value, uom)})
+            nodes = collections.OrderedDict()
+            self.local.nodes = nodes
+            self.local.depth = 0
+        return nodes
+
+    """
+        Context manager for a publish cycle, the updates made inside it
+        are sent when it ends.
+    """
+    def cycle(self):
+        return Cycle(self)
+
+    def begin(self):
+        self.staged()
+        self.local.depth += 1
+
+    def end(self):
+        self.local.depth -= 1
+        if self.local.depth == 0:
+            self.flush()
+
+    def in_cycle(self):
+        return getattr(self.local, 'depth', 0) > 0
+
+    """
+        Send a driver update now, or stage it if this thread is in a
+        publish cycle.
+    """
+    def send(self, node, driver, value, uom, force=False):
+        if force or not self.in_cycle():
+            if self.in_cycle():
+                entry = self.staged().get(node.address)
+                if entry is not None:
+                    entry[1].pop(driver, None)
+            with self.lock:
+                self.set_driver(node, driver, value, uom, force)
+            return
+
+        nodes = self.staged()
+        entry = nodes.get(node.address)
+        if entry is None:
+            entry = (node, collections.OrderedDict())
+            nodes[node.address] = entry
+        if driver in entry[1]:
+            if self.metrics is not None:
+                self.metrics.inc('driver_updates_coalesced_total')
+        entry[1][driver] = (value, uom)
+
+    # Send everything this thread has staged
+    def flush(self):
+        nodes = self.staged()
+        if len(nodes) == 0:
+            return
+        start = time.perf_counter()
+        count = 0
+        while len(nodes) > 0:
+            (address, (node, drivers)) = nodes.popitem(last=False)
+            for driver in drivers:
+                (value, uom) = drivers[driver]
+                self.throttle()
+                with self.lock:
+                    self.set_driver(node, driver, value, uom, False)
+                count += 1
+        if self.metrics is not None:
+            self.metrics.observe('publish_flush_seconds', time.perf_counter() - start)
+        LOGGER.debug('Published {} driver updates'.format(count))
+
+    def set_driver(self, node, driver, value, uom, force):
+        node.setDriver(driver, value, True, force, uom)
+        if self.metrics is not None:
+            self.metrics.inc('driver_updates_sent_total')
+
+    """
+        Take a token, waiting for one if the bucket is empty.  The token
+        is reserved holding bucket_lock (the count can go negative) and
+        the wait is done without holding any lock.
+    """
+    def throttle(self):
+        if self.rate <= 0:
+            return
+        with self.bucket_lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.refilled) * self.rate)
+            self.refilled = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate
+        if wait > 0:
+            time.sleep(wait)
+
+
+class Cycle:
+    def __init__(self, buffer):
+        self.buffer = buffer
+
+    def __enter__(self):
+        self.buffer.begin()
+        return self
+
+    def __exit__(self, *exc):
+        self.buffer.end()
+        return False
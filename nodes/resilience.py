@@ -0,0 +1,82 @@
+#
+#  Retry handling for station queries.
+#
+#  After a failed query the station is retried with a jittered
+#  exponential backoff instead of on every short poll.  If it keeps
+#  failing the circuit breaker opens and the station is only probed
+#  every PROBE_INTERVAL seconds until a query succeeds again.
+#
+#  The breaker state values are used directly as the controller's ST
+#  driver value.
+
+import time
+import random
+
+OPEN = 0          # failing, only probing occasionally
+CLOSED = 1        # working normally
+HALF_OPEN = 2     # retrying / probing
+
+FAILURE_THRESHOLD = 5
+BACKOFF_BASE = 10
+BACKOFF_MAX = 300
+PROBE_INTERVAL = 600
+
+
+class CircuitBreaker:
+    def __init__(self, threshold=FAILURE_THRESHOLD, base=BACKOFF_BASE,
+                 cap=BACKOFF_MAX, probe=PROBE_INTERVAL):
+        self.threshold = threshold
+        self.base = base
+        self.cap = cap
+        self.probe = probe
+        self.state = CLOSED
+        self.failures = 0
+        self.next_attempt = 0
+
+    # Is a query allowed now?
+    def allow(self, now=None):
+        if now is None:
+            now = time.time()
+        if now < self.next_attempt:
+            return False
+        if self.state == OPEN:
+            self.state = HALF_OPEN
+        return True
+
+    def success(self):
+        self.state = CLOSED
+        self.failures = 0
+        self.next_attempt = 0
+
+    def failure(self, now=None):
+        if now is None:
+            now = time.time()
+        self.failures += 1
+
+        if self.failures >= self.threshold:
+            # open, or a probe failed so stay open
+            self.state = OPEN
+            self.next_attempt = now + self.probe
+        else:
+            # exponential backoff, randomized so that stations don't
+            # all retry at the same time
+            delay = min(self.cap, self.base * (2 ** (self.failures - 1)))
+            self.state = HALF_OPEN
+            self.next_attempt = now + random.uniform(delay / 2, delay)
+
+        return self.next_attempt - now
+
+
+"""
+    Combine the breaker states of several stations into one status
+    value.  Any station failing shows as OPEN, any retrying shows as
+    HALF_OPEN.
+"""
+def combined_state(breakers):
+    state = CLOSED
+    for breaker in breakers:
+        if breaker.state == OPEN:
+            return OPEN
+        if breaker.state == HALF_OPEN:
+            state = HALF_OPEN
+    return state
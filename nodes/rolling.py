@@ -0,0 +1,284 @@
+#
+#  Rolling window statistics calculated from the observations.
+#
+#  The cloud's pressure trend only changes when the console uploads and
+#  local sources (the WeatherLink Live hub) don't have the same set of
+#  values, so the trend, wind averages, gust and rain rate are
+#  calculated here from the stream of observations instead.  Every
+#  source is converted to the same payload layout (US units) before it
+#  gets here, so the results are the same whichever source is used.
+#
+#  Each value is kept in a fixed size ring buffer of (time, value)
+#  samples.  Adding a sample and dropping the ones that have left the
+#  window are O(1) (amortized for the gust peak), the sums needed for
+#  the averages are kept up to date as samples come and go.
+#
+#  Wind direction is vector averaged, the average of the unit vectors,
+#  so 350 and 10 degrees average to 0 and not 180.
+
+import math
+import functools
+import collections
+from nodes import decode
+from nodes import trend
+from nodes import uom
+from nodes import schema
+
+SECTION = decode.SECTION
+
+# The pressure tendency is the change over 3 hours.  With less history
+# than that, the change is scaled up from at least TREND_MIN_SPAN.
+TREND_WINDOW = 3 * 3600
+TREND_MIN_SPAN = 3600
+# seconds between the pressure and rain samples kept
+PRESSURE_INTERVAL = 60
+RAIN_INTERVAL = 60
+RAIN_WINDOW = 15 * 60
+# wind averages, (short, long) seconds
+WIND_WINDOWS = (2 * 60, 10 * 60)
+GUST_WINDOW = 10 * 60
+# enough for the WeatherLink Live's 2.5 second broadcasts
+WIND_SIZE = 256
+
+# (driver, quantity), see schema.CURRENT
+DRIVERS = schema.rolling_drivers()
+
+
+"""
+    Return a tuple of (driver, converter, precision) for the rolling
+    drivers in a unit configuration.
+"""
+@functools.lru_cache(maxsize=None)
+def plan(units):
+    system = uom.unit_system(units)
+    entries = []
+    for (driver, quantity) in DRIVERS:
+        (convert, prec, unit) = uom.conversion(quantity, system)
+        if quantity == 'trend':
+            # the tendency is already a trend code
+            convert = int
+        entries.append((driver, convert, prec))
+    return tuple(entries)
+
+
+"""
+    A fixed size ring of (time, value) samples covering the last window
+    seconds.  Samples closer than interval seconds to the newest one are
+    ignored.  When the ring is full the oldest sample is dropped, even
+    if it is still in the window.
+"""
+class Ring:
+    def __init__(self, size, window, interval=0):
+        self.size = size
+        self.window = window
+        self.interval = interval
+        self.times = [0.0] * size
+        self.values = [0.0] * size
+        self.first = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def index(self, n):
+        return (self.first + n) % self.size
+
+    def oldest(self):
+        i = self.first
+        return (self.times[i], self.values[i])
+
+    def newest(self):
+        i = self.index(self.count - 1)
+        return (self.times[i], self.values[i])
+
+    def append(self, ts, value):
+        if self.count > 0 and ts < self.newest()[0] + max(self.interval, 1e-6):
+            return False
+        self.expire(ts)
+        if self.count == self.size:
+            self.removed(self.times[self.first], self.values[self.first])
+            self.first = self.index(1)
+            self.count -= 1
+        i = self.index(self.count)
+        self.times[i] = ts
+        self.values[i] = value
+        self.count += 1
+        self.added(ts, value)
+        return True
+
+    def expire(self, now):
+        start = now - self.window
+        while self.count > 0 and self.times[self.first] <= start:
+            self.removed(self.times[self.first], self.values[self.first])
+            self.first = self.index(1)
+            self.count -= 1
+
+    # hooks for keeping running totals
+    def added(self, ts, value):
+        pass
+
+    def removed(self, ts, value):
+        pass
+
+
+# Wind samples are (speed, direction) with running sums for the averages
+class WindRing(Ring):
+    def __init__(self, size, window):
+        Ring.__init__(self, size, window)
+        self.values = [(0.0, 0.0)] * size
+        self.reset()
+
+    def reset(self):
+        self.speed = 0.0
+        self.east = 0.0
+        self.north = 0.0
+
+    def added(self, ts, value):
+        (speed, direction) = value
+        self.speed += speed
+        self.east += math.sin(math.radians(direction))
+        self.north += math.cos(math.radians(direction))
+
+    def removed(self, ts, value):
+        if self.count == 1:
+            # start over rather than keep rounding errors
+            self.reset()
+            return
+        (speed, direction) = value
+        self.speed -= speed
+        self.east -= math.sin(math.radians(direction))
+        self.north -= math.cos(math.radians(direction))
+
+    def averages(self):
+        if self.count == 0:
+            return (None, None)
+        speed = max(0.0, self.speed / self.count)
+        if abs(self.east) < 1e-9 and abs(self.north) < 1e-9:
+            return (speed, None)
+        return (speed, round(math.degrees(math.atan2(self.east, self.north)), 1) % 360)
+
+
+"""
+    The peak over a window, kept as a queue of decreasing values (each
+    sample is added and removed once).  The queue is bounded by the
+    ring size, the same as the other windows.
+"""
+class PeakRing(Ring):
+    def __init__(self, size, window):
+        Ring.__init__(self, size, window)
+        self.peaks = collections.deque()
+
+    def added(self, ts, value):
+        peaks = self.peaks
+        while len(peaks) > 0 and peaks[-1][1] <= value:
+            peaks.pop()
+        peaks.append((ts, value))
+
+    def removed(self, ts, value):
+        if len(self.peaks) > 0 and self.peaks[0][0] <= ts:
+            self.peaks.popleft()
+
+    def peak(self):
+        if len(self.peaks) == 0:
+            return None
+        return self.peaks[0][1]
+
+
+class Rolling:
+    def __init__(self):
+        self.pressure = Ring(TREND_WINDOW // PRESSURE_INTERVAL + 2,
+                TREND_WINDOW + PRESSURE_INTERVAL, PRESSURE_INTERVAL)
+        self.wind = tuple(WindRing(WIND_SIZE, w) for w in WIND_WINDOWS)
+        self.gust = PeakRing(WIND_SIZE, GUST_WINDOW)
+        # running rain total, so the daily reset doesn't matter
+        self.rain = Ring(RAIN_WINDOW // RAIN_INTERVAL + 2,
+                RAIN_WINDOW + RAIN_INTERVAL, RAIN_INTERVAL)
+        self.rain_total = 0.0
+        self.rain_day = None
+        self.last = None
+
+    """
+        Add the values from an observation made at ts (unix seconds).
+        Observations older than the last one added are ignored.
+    """
+    def update(self, obs, ts):
+        if ts is None or (self.last is not None and ts <= self.last):
+            return False
+        self.last = ts
+
+        pressure = obs.get(None, 'pressure_in')
+        if pressure is not None:
+            self.pressure.append(ts, pressure)
+
+        speed = obs.get(None, 'wind_mph')
+        direction = obs.get(None, 'wind_degrees')
+        if speed is not None and direction is not None:
+            for ring in self.wind:
+                ring.append(ts, (speed, direction))
+        # the source's own 10 minute gust covers the wind between samples
+        gust = obs.get(SECTION, 'wind_ten_min_gust_mph')
+        if speed is not None or gust is not None:
+            self.gust.append(ts, max(v for v in (speed, gust) if v is not None))
+
+        rain = obs.get(SECTION, 'rain_day_in')
+        if rain is not None:
+            if self.rain_day is not None:
+                # the daily total starts over at midnight
+                self.rain_total += rain - self.rain_day if rain >= self.rain_day else rain
+            self.rain_day = rain
+            self.rain.append(ts, self.rain_total)
+
+        return True
+
+    # pressure change (inHg) over 3 hours, None without enough history
+    def pressure_change(self):
+        if len(self.pressure) < 2:
+            return None
+        (start, first) = self.pressure.oldest()
+        (end, last) = self.pressure.newest()
+        span = end - start
+        if span < TREND_MIN_SPAN:
+            return None
+        return (last - first) * min(TREND_WINDOW / span, TREND_WINDOW / TREND_MIN_SPAN)
+
+    def tendency(self):
+        change = self.pressure_change()
+        if change is None:
+            return None
+        return trend.get_trend(trend.trend_string(change))
+
+    # inches per hour over the last 15 minutes
+    def rain_rate(self):
+        if len(self.rain) < 2:
+            return None
+        (start, first) = self.rain.oldest()
+        (end, last) = self.rain.newest()
+        if end - start < RAIN_INTERVAL:
+            return None
+        return (last - first) * 3600 / (end - start)
+
+    """
+        Return the values in US units, {driver: value}, leaving out the
+        ones there isn't enough data for yet.
+    """
+    def values(self):
+        (short, long) = (w.averages() for w in self.wind)
+        results = {
+                'GV6': short[0],
+                'GV7': short[1],
+                'GV14': long[0],
+                'GV15': long[1],
+                'GV13': self.gust.peak(),
+                'RAINRT': self.rain_rate(),
+                'GV16': self.tendency(),
+                }
+        return dict((d, v) for (d, v) in results.items() if v is not None)
+
+    # Return the (driver, value, precision) updates for a unit configuration
+    def updates(self, units):
+        values = self.values()
+        updates = []
+        for (driver, convert, prec) in plan(units):
+            if driver in values:
+                updates.append((driver, convert(values[driver]), prec))
+        return updates
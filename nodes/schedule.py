@@ -0,0 +1,106 @@
+#
+#  Track when the station uploads new observations to WeatherLink.
+#
+#  The console uploads on its own schedule so most polls return the same
+#  observation we already have.  This keeps track of the last observation
+#  processed and learns the upload interval from the observation times so
+#  that the next poll can be scheduled just after the next upload is
+#  expected.
+
+import time
+from email.utils import parsedate_to_datetime
+
+# seconds to wait after the expected upload before polling
+UPLOAD_MARGIN = 5
+# ignore upload intervals outside of this range (seconds)
+MIN_INTERVAL = 30
+MAX_INTERVAL = 3600
+
+
+# Return the time (unix seconds) the observation was made.  The
+# observation_age is relative to when the server generated the payload
+# so it isn't affected by differences between our clock and the
+# station's clock.
+def observation_epoch(obs, now):
+    age = obs.get('davis_current_observation', 'observation_age')
+    if age is not None:
+        return now - age
+
+    try:
+        return parsedate_to_datetime(obs.get(None, 'observation_time_rfc822')).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+class UploadSchedule:
+    def __init__(self, margin=UPLOAD_MARGIN):
+        self.margin = margin
+        self.last_observation = None
+        self.last_epoch = None
+        self.interval = None
+        # interval to use until one is learned, None to poll at the
+        # short poll rate
+        self.default_interval = None
+        self.next_poll = 0
+
+    def due(self, now=None):
+        if now is None:
+            now = time.time()
+        return now >= self.next_poll
+
+    """
+        Check if the payload holds a new observation and update the
+        schedule for the next poll.
+
+        return True if the observation hasn't been processed yet.
+    """
+    def is_new(self, obs, now=None):
+        if now is None:
+            now = time.time()
+
+        observation = obs.get(None, 'observation_time_rfc822')
+        if observation is not None and observation == self.last_observation:
+            # The upload is late, keep checking at the normal poll rate
+            self.next_poll = 0
+            return False
+
+        epoch = observation_epoch(obs, now)
+        if epoch is not None and self.last_epoch is not None:
+            self.learn(epoch - self.last_epoch)
+
+        self.last_observation = observation
+        self.last_epoch = epoch
+
+        interval = self.interval
+        if interval is None:
+            interval = self.default_interval
+        if epoch is not None and interval is not None:
+            self.next_poll = epoch + interval + self.margin
+        else:
+            self.next_poll = 0
+
+        return True
+
+    """
+        Learn the upload interval from the time between two new
+        observations.  A missed or late upload shows up as a multiple
+        of the interval, so the gap is divided by the number of
+        intervals it covers.  Otherwise a single missed upload would
+        double the interval and, since the next poll is only made after
+        the learned interval, it would never be seen to shrink again.
+    """
+    def learn(self, delta):
+        if delta < MIN_INTERVAL or delta > MAX_INTERVAL:
+            return
+        if self.interval is None:
+            self.interval = delta
+            return
+        uploads = max(1, round(delta / self.interval))
+        if uploads == 1:
+            self.interval = delta
+        else:
+            self.interval = min(self.interval, delta / uploads)
+
+    def reset(self):
+        self.last_observation = None
+        self.next_poll = 0
@@ -0,0 +1,410 @@
+#
+#  Node and driver schema.
+#
+#  This is the one place the nodes, their drivers and commands are
+#  defined.  Everything else is built from it:
+#
+#     - the drivers list of each node class
+#     - the driver UOM tables for each unit configuration
+#     - the extraction tables (extract.CURRENT and OBSERVATIONS) and the
+#       rolling window drivers
+#     - the profile files, nodedefs.xml, editors.xml and en_us.txt
+#
+#  Each driver is (driver, quantity, NLS name, source).  quantity is the
+#  uom.QUANTITIES entry used to convert and display it.  source is where
+#  the value comes from: a (section, payload key) pair for the current
+#  conditions, a payload key with '{p}' for the period name for the
+#  day/month/year nodes, ROLLING for the rolling window values and None
+#  for values the controller sets itself.
+#
+#  The profile files are regenerated when the node server starts and
+#  are only installed when their hash differs from the last one
+#  installed.
+#
+#     python3 -m nodes.schema     writes the profile files
+
+import sys
+import os
+import hashlib
+import functools
+from types import MappingProxyType
+import polyinterface
+import node_funcs
+from nodes import uom
+
+SECTION = 'davis_current_observation'
+ROLLING = 'rolling'
+PERIODS = ('day', 'month', 'year')
+
+STATUS = (
+        ('ST', 'status', 'Server Status', None),
+        )
+
+CURRENT = (
+        ('CLITEMP', 'temperature', 'Temperature', (None, 'temp_f')),
+        ('CLIHUM', 'humidity', 'Humidity', (None, 'relative_humidity')),
+        ('DEWPT', 'temperature', 'Dew Point', (None, 'dewpoint_f')),
+        ('GV3', 'temperature', 'Heat Index', (None, 'heat_index_f')),
+        ('GV4', 'temperature', 'Windchill', (None, 'windchill_f')),
+        ('BARPRES', 'pressure', 'Pressure', (None, 'pressure_in')),
+        ('WINDDIR', 'direction', 'Wind Direction', (None, 'wind_degrees')),
+        ('SPEED', 'speed', 'Wind Speed', (None, 'wind_mph')),
+        ('GV16', 'trend', 'Pressure Trend', (SECTION, 'pressure_tendency_string')),
+        ('SOLRAD', 'solar', 'Solar Radiation', (SECTION, 'solar_radiation')),
+        ('GV6', 'speed', 'Wind Speed 2 min', ROLLING),
+        ('GV7', 'direction', 'Wind Direction 2 min', ROLLING),
+        ('GV14', 'speed', 'Wind Speed 10 min', ROLLING),
+        ('GV15', 'direction', 'Wind Direction 10 min', ROLLING),
+        ('GV13', 'speed', 'Wind Gust 10 min', ROLLING),
+        ('RAINRT', 'rain_rate', 'Rain Rate', ROLLING),
+        )
+
+# Payload values that are replaced by the rolling window value once
+# there is enough history for it.
+CALCULATED = ('GV16',)
+
+METRICS = (
+        ('GV21', 'milliseconds', 'Fetch Time', None),
+        ('GV22', 'milliseconds', 'Fetch Time 95%', None),
+        ('GV23', 'percent', 'Updates Suppressed', None),
+        ('GV24', 'count', 'Consecutive Failures', None),
+        ('GV25', 'seconds', 'Data Age', None),
+        ('GV26', 'seconds', 'Data Latency 95%', None),
+        )
+
+# (driver, quantity, NLS name, source, periods)
+PERIOD = (
+        ('GV0', 'temperature', 'High Temperature', 'temp_{p}_high_f', PERIODS),
+        ('GV1', 'temperature', 'Low Temperature', 'temp_{p}_low_f', PERIODS),
+        ('GV2', 'temperature', 'High Dewpoint', 'dewpoint_{p}_high_f', PERIODS),
+        ('GV3', 'temperature', 'Low Dewpoint', 'dewpoint_{p}_low_f', PERIODS),
+        ('GV4', 'temperature', 'High Heat Index', 'heat_index_{p}_high_f', PERIODS),
+        ('GV5', 'temperature', 'Low Windchill', 'windchill_{p}_low_f', PERIODS),
+        ('GV8', 'humidity', 'High Humidity', 'relative_humidity_{p}_high', PERIODS),
+        ('GV9', 'humidity', 'Low Humidity', 'relative_humidity_{p}_low', PERIODS),
+        ('GV10', 'pressure', 'High Pressure', 'pressure_{p}_high_in', PERIODS),
+        ('GV11', 'pressure', 'Low Pressure', 'pressure_{p}_low_in', PERIODS),
+        ('GV12', 'rain', 'Precipitation', 'rain_{p}_in', PERIODS),
+        ('RAINRT', 'rain_rate', 'High Rain Rate', 'rain_rate_{p}_high_in_per_hr', PERIODS),
+        ('SPEED', 'speed', 'High Wind Speed', 'wind_{p}_high_mph', PERIODS),
+        ('GV13', 'speed', 'Average Wind Gusts', 'wind_ten_min_gust_mph', ('day',)),
+        ('SOLRAD', 'solar', 'High Solar Radiation', 'solar_radiation_{p}_high', PERIODS),
+        ('UV', 'uv', 'High UV Index', 'uv_index_{p}_high', PERIODS),
+        ('GV20', 'et', 'High Evapotranspiration', 'et_{p}', PERIODS),
+        )
+
+
+def period_drivers(period):
+    return tuple(d[:4] for d in PERIOD if period in d[4])
+
+
+# (command, NLS name, parameter editor, parameter initial value)
+CONTROLLER_COMMANDS = (
+        ('DISCOVER', 'Re-Discover', None, None),
+        ('REMOVE_NOTICES_ALL', 'Remove Notices', None, None),
+        ('UPDATE_PROFILE', 'Update Profile', None, None),
+        ('DEBUG', 'Log Level', 'DEBUG', 30),
+        ('SET_UNITS', 'Units', 'UNITS', None),
+        )
+
+NODES = (
+        {
+        'id': 'WeatherLink',
+        'comment': 'controller with current conditions',
+        'nls': 'cc',
+        'name': 'Weather Data',
+        'drivers': STATUS + CURRENT + METRICS,
+        'sends': ('DON', 'DOF'),
+        'accepts': CONTROLLER_COMMANDS,
+        },
+        {
+        'id': 'station',
+        'comment': 'current conditions for additional stations',
+        'nls': 'cc',
+        'name': 'Current Conditions',
+        'drivers': CURRENT,
+        },
+        {
+        'id': 'day',
+        'nls': 'hst',
+        'name': 'Daily Observations',
+        'drivers': period_drivers('day'),
+        },
+        {
+        'id': 'month',
+        'nls': 'hst',
+        'name': 'Monthly Observations',
+        'drivers': period_drivers('month'),
+        },
+        {
+        'id': 'year',
+        'nls': 'hst',
+        'name': 'Yearly Observations',
+        'drivers': period_drivers('year'),
+        },
+        )
+
+# quantity : (editor, minimum, maximum, NLS list).  The minimum and
+# maximum are in US units and converted for each UOM.
+EDITORS = {
+        'status': ('STATUS', 0, 3, 'EN_STATUS'),
+        'temperature': ('TEMPERATURE', -60, 150, None),
+        'humidity': ('PERCENT', 0, 100, None),
+        'pressure': ('PRESSURE', 25, 35, None),
+        'rain': ('RAIN', 0, 400, None),
+        'rain_rate': ('RATE', 0, 80, None),
+        'speed': ('SPEED', 0, 250, None),
+        'direction': ('DEGREES', 0, 360, None),
+        'solar': ('SOLARRAD', 0, 2000, None),
+        'uv': ('UV', 0, 16, None),
+        'et': ('ET', 0, 100, None),
+        'trend': ('TREND', 0, 6, 'EN_TREND'),
+        'seconds': ('SECONDS', 0, 86400, None),
+        'milliseconds': ('MSEC', 0, 100000, None),
+        'percent': ('RATIO', 0, 100, None),
+        'count': ('COUNT', 0, 100000, None),
+        }
+
+# Command parameter editors, editor : range attributes
+COMMAND_EDITORS = {
+        'DEBUG': (('uom', 25), ('subset', '0,10,20,30,40,50'), ('nls', 'DBG')),
+        'UNITS': (('uom', 25), ('min', 0), ('max', len(uom.SYSTEMS) - 1), ('nls', 'EN_UNITS')),
+        }
+
+# NLS lists, name : ((value, text), ...)
+LISTS = (
+        ('DBG', ((0, 'Off'), (10, 'Debug'), (20, 'Info'), (30, 'Warning'),
+            (40, 'Error'), (50, 'Critical'))),
+        ('EN_STATUS', ((0, 'Offline'), (1, 'Online'), (2, 'Retrying'), (3, 'Stale'))),
+        ('EN_UNITS', ((0, 'US'), (1, 'Metric'), (2, 'SI'), (3, 'UK'))),
+        ('EN_TREND', ((0, 'Falling'), (1, 'Steady'), (2, 'Rising'),
+            (3, 'Rising Slowly'), (4, 'Falling Slowly'), (5, 'Rising Rapidly'),
+            (6, 'Falling Rapidly'))),
+        )
+
+ICON = 'Weather'
+NODE_TYPE = 139
+
+
+def node(node_id):
+    for entry in NODES:
+        if entry['id'] == node_id:
+            return entry
+    raise KeyError(node_id)
+
+
+"""
+    Return the quantity of each driver.  A driver id has to mean the
+    same kind of value on every node, the UOM table is shared.
+"""
+def driver_quantities():
+    quantities = {}
+    for entry in NODES:
+        for (driver, quantity, name, source) in entry['drivers']:
+            if quantities.setdefault(driver, quantity) != quantity:
+                raise ValueError('{} is both {} and {}'.format(driver, quantities[driver], quantity))
+    return quantities
+
+DRIVERS = driver_quantities()
+
+
+# Initial driver values, 0 if not listed
+INITIAL = {
+        'ST': 1,
+        }
+
+
+# Return a new drivers list, with US UOMs, for a node class
+def drivers(node_id):
+    return [{'driver': d[0], 'value': INITIAL.get(d[0], 0), 'uom': uom.conversion(d[1], 'us')[2]}
+            for d in node(node_id)['drivers']]
+
+
+# Return a read-only dictionary with driver names as the key and the
+# UOM for the requested unit configuration.
+@functools.lru_cache(maxsize=None)
+def get_uom(units):
+    system = uom.unit_system(units)
+    table = {}
+    for driver in DRIVERS:
+        table[driver] = uom.conversion(DRIVERS[driver], system)[2]
+    return MappingProxyType(table)
+
+
+# (driver, section, key, quantity) for the current conditions
+def current_sources():
+    return tuple((d, s[0], s[1], q) for (d, q, n, s) in CURRENT if isinstance(s, tuple))
+
+
+# (driver, quantity) for the rolling window values
+def rolling_drivers():
+    return tuple((d, q) for (d, q, n, s) in CURRENT if s == ROLLING or d in CALCULATED)
+
+
+# (driver, source key, quantity, periods) for the period nodes
+def period_sources():
+    return tuple((d, s, q, p) for (d, q, n, s, p) in PERIOD)
+
+
+def number(value):
+    return '{:g}'.format(value)
+
+
+def editor_ranges(quantity):
+    (editor, low, high, nls) = EDITORS[quantity]
+    ranges = []
+    seen = set()
+    for system in uom.SYSTEMS:
+        (convert, prec, unit) = uom.conversion(quantity, system)
+        if unit in seen:
+            continue
+        seen.add(unit)
+        attrs = [('uom', unit)]
+        if nls is not None:
+            attrs += [('min', low), ('max', high), ('nls', nls)]
+        else:
+            attrs += [('min', number(round(convert(low), prec))),
+                    ('max', number(round(convert(high), prec))), ('prec', prec)]
+        ranges.append(attrs)
+    return ranges
+
+
+def range_xml(attrs):
+    return '<range ' + ' '.join('{}="{}"'.format(k, v) for (k, v) in attrs) + ' />'
+
+
+def editors_xml():
+    used = []
+    for entry in NODES:
+        for driver in entry['drivers']:
+            if EDITORS[driver[1]][0] not in used:
+                used.append(EDITORS[driver[1]][0])
+
+    lines = ['<editors>']
+    for quantity in EDITORS:
+        if EDITORS[quantity][0] not in used:
+            continue
+        lines.append('    <editor id="{}">'.format(EDITORS[quantity][0]))
+        for attrs in editor_ranges(quantity):
+            lines.append('        ' + range_xml(attrs))
+        lines.append('    </editor>')
+    for editor in COMMAND_EDITORS:
+        lines.append('    <editor id="{}">'.format(editor))
+        lines.append('        ' + range_xml(COMMAND_EDITORS[editor]))
+        lines.append('    </editor>')
+    lines.append('</editors>')
+    return '\n'.join(lines) + '\n'
+
+
+def nodedefs_xml():
+    lines = ['<nodeDefs>']
+    for entry in NODES:
+        if 'comment' in entry:
+            lines.append('    <!-- {} -->'.format(entry['comment']))
+        lines.append('    <nodeDef id="{}" nodeType="{}" nls="{}">'.format(entry['id'], NODE_TYPE, entry['nls']))
+        lines.append('        <editors />')
+        lines.append('        <sts>')
+        for (driver, quantity, name, source) in entry['drivers']:
+            lines.append('            <st id="{}" editor="{}" />'.format(driver, EDITORS[quantity][0]))
+        lines.append('        </sts>')
+        lines.append('        <cmds>')
+        sends = entry.get('sends', ())
+        accepts = entry.get('accepts', ())
+        if len(sends) == 0:
+            lines.append('            <sends />')
+        else:
+            lines.append('            <sends>')
+            for cmd in sends:
+                lines.append('                <cmd id="{}" />'.format(cmd))
+            lines.append('            </sends>')
+        if len(accepts) == 0:
+            lines.append('            <accepts />')
+        else:
+            lines.append('            <accepts>')
+            for (cmd, name, editor, init) in accepts:
+                if editor is None:
+                    lines.append('                <cmd id="{}" />'.format(cmd))
+                    continue
+                lines.append('                <cmd id="{}">'.format(cmd))
+                init = '' if init is None else ' init="{}"'.format(init)
+                lines.append('                    <p id="" editor="{}"{} />'.format(editor, init))
+                lines.append('                </cmd>')
+            lines.append('            </accepts>')
+        lines.append('        </cmds>')
+        lines.append('    </nodeDef>')
+    lines.append('</nodeDefs>')
+    return '\n'.join(lines) + '\n'
+
+
+def nls_text():
+    lines = []
+    names = {}
+    for entry in NODES:
+        lines.append('ND-{}-NAME = {}'.format(entry['id'], entry['name']))
+        lines.append('ND-{}-ICON = {}'.format(entry['id'], ICON))
+    for entry in NODES:
+        prefix = entry['nls']
+        for (cmd, name, editor, init) in entry.get('accepts', ()):
+            lines.append('CMD-{}-{}-NAME = {}'.format(prefix, cmd, name))
+        for (driver, quantity, name, source) in entry['drivers']:
+            key = 'ST-{}-{}-NAME'.format(prefix, driver)
+            if key in names:
+                # nodes sharing the NLS prefix must agree on the names
+                if names[key] != name:
+                    raise ValueError('{} is both {} and {}'.format(key, names[key], name))
+                continue
+            names[key] = name
+            lines.append('{} = {}'.format(key, name))
+
+    for (name, values) in LISTS:
+        lines.append('')
+        for (value, text) in values:
+            lines.append('{}-{} = {}'.format(name, value, text))
+    return '\n'.join(lines) + '\n'
+
+
+# The profile files, path relative to the profile directory : contents
+def profile_files():
+    return {
+            os.path.join('nodedef', 'nodedefs.xml'): nodedefs_xml(),
+            os.path.join('editor', 'editors.xml'): editors_xml(),
+            os.path.join('nls', 'en_us.txt'): nls_text(),
+            }
+
+
+def profile_hash(files):
+    digest = hashlib.sha256()
+    for name in sorted(files):
+        digest.update(name.replace(os.sep, '/').encode('utf-8') + b'\0')
+        digest.update(files[name].encode('utf-8') + b'\0')
+    return digest.hexdigest()
+
+
+"""
+    Write the profile files that differ from the ones in directory.
+    Returns the list of files written.
+"""
+def write_profile(directory, files):
+    written = []
+    for name in sorted(files):
+        path = os.path.join(directory, name)
+        try:
+            with open(path) as f:
+                if f.read() == files[name]:
+                    continue
+        except OSError:
+            pass
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        node_funcs.save_text(path, files[name])
+        written.append(name)
+    return written
+
+
+if __name__ == "__main__":
+    # polyinterface sends stdout to its log when imported, put it back
+    polyinterface.unload_interface()
+    directory = sys.argv[1] if len(sys.argv) > 1 else 'profile'
+    files = profile_files()
+    for name in write_profile(directory, files):
+        print('wrote ' + os.path.join(directory, name))
+    print('profile hash ' + profile_hash(files))
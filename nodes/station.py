@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Polyglot v2 node server for Davis WeatherLink Weather Station data.
+Copyright (c) 2020 Robert Paauwe
+"""
+import time
+import threading
+import polyinterface
+import node_funcs
+from nodes import schema
+from nodes import schedule
+from nodes import resilience
+from nodes import metadata
+
+LOGGER = polyinterface.LOGGER
+
+"""
+    A WeatherLink station that is being polled.
+
+    The primary station (configured with the Device ID, Password and
+    API Token parameters) uses the controller node for its current
+    conditions and the 'day', 'month', 'year' node addresses. Additional
+    stations get their own current conditions node and each of their
+    node addresses is prefixed with 's<n>'.
+"""
+class Station:
+    def __init__(self, index, device_id, password, token):
+        self.index = index
+        self.set_credentials(device_id, password, token)
+        self.schedule = schedule.UploadSchedule()
+        self.breaker = resilience.CircuitBreaker()
+        self.metadata = metadata.StationMetadata()
+        # WeatherLink Live client when the station is read locally
+        self.live = None
+        # station id when the station is read with the v2 API
+        self.v2 = None
+        # the station's time zone (tzinfo) for the WeatherLink Live and
+        # v2 payloads, None until it is known from the metadata or the v2
+        # station
+        self.zone = None
+        # last payload successfully received, when it was requested and
+        # when it was received
+        self.last_payload = None
+        self.last_requested = None
+        self.last_received = None
+        # held while the last payload is replaced or merged with a
+        # real-time packet, the query and broadcast threads both do it
+        self.payload_lock = threading.Lock()
+        # time (unix seconds) of the last observation published
+        self.observed = None
+        if index == 0:
+            self.prefix = ''
+            self.name = ''
+        else:
+            self.prefix = 's{}'.format(index)
+            self.name = 'Station {} '.format(index)
+
+    def set_credentials(self, device_id, password, token):
+        self.device_id = device_id
+        self.password = password
+        self.token = token
+        # (base, endpoint) : url
+        self.urls = {}
+
+    def address(self, node):
+        return self.prefix + node
+
+    # Save a complete observation returned by a query
+    def set_payload(self, obs, requested=None):
+        with self.payload_lock:
+            self.last_payload = obs
+            self.last_requested = requested
+            self.last_received = time.time()
+
+    def payload_age(self, now):
+        if self.last_received is None:
+            return None
+        return now - self.last_received
+
+    def url(self, base, endpoint='NoaaExt.json'):
+        path = self.urls.get((base, endpoint))
+        if path is None:
+            path = base + endpoint + '?'
+            path += 'user=' + self.device_id
+            path += '&pass=' + self.password
+            path += '&apiToken=' + self.token
+            self.urls[(base, endpoint)] = path
+        return path
+
+
+"""
+    Parse the Stations parameter into a list of (device id, password,
+    api token) tuples.  Stations are separated by ';' and each station
+    is 'DeviceID:Password:APIToken'.  The password may contain ':'.
+"""
+def parse_station_list(value):
+    stations = []
+    if value is None:
+        return stations
+
+    for entry in value.split(';'):
+        entry = entry.strip()
+        if entry == '':
+            continue
+        parts = entry.split(':')
+        if len(parts) < 3:
+            LOGGER.error('Invalid station entry, expected DeviceID:Password:APIToken')
+            continue
+        stations.append((parts[0].strip(), ':'.join(parts[1:-1]),
+                         parts[-1].strip()))
+
+    return stations
+
+
+@node_funcs.add_functions_as_methods(node_funcs.functions)
+class StationNode(polyinterface.Node):
+    id = 'station'
+    hint = [1,11,0,0]
+    units = 'us'
+    uom = {}
+    drivers = schema.drivers('station')
+
+    def SetUnits(self, units):
+        self.units = units
+        self.uom = schema.get_uom(self.units)
+
+    def parse(self, jdata):
+        self.controller.parse_current_conditions(jdata, self)
@@ -0,0 +1,81 @@
+#
+#  HTTP transport used to query the WeatherLink servers.
+#
+#  A single requests session is kept for the life of the node server so
+#  that connections to api.weatherlink.com are pooled and kept alive
+#  between polls instead of doing a new TLS handshake every time.  All
+#  requests use separate connect and read timeouts so a hung socket can't
+#  stall the poll thread.
+#
+#  Once closed the transport stays closed until it is opened again, a
+#  request made after close() (i.e. by a worker thread still fetching
+#  during shutdown) fails instead of opening a new session.
+
+import threading
+import polyinterface
+import requests
+from requests.adapters import HTTPAdapter
+
+LOGGER = polyinterface.LOGGER
+
+DEFAULT_CONNECT_TIMEOUT = 5.0
+DEFAULT_READ_TIMEOUT = 15.0
+
+
+# Convert a timeout parameter value to seconds, falling back to the
+# default if the value isn't usable.
+def to_timeout(value, default):
+    try:
+        timeout = float(value)
+        if timeout > 0:
+            return timeout
+    except (TypeError, ValueError):
+        pass
+    LOGGER.warning('Invalid timeout value {}, using {}'.format(value, default))
+    return default
+
+
+class Transport:
+    def __init__(self, connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout=DEFAULT_READ_TIMEOUT, pool_size=4):
+        self.timeout = (connect_timeout, read_timeout)
+        self.pool_size = pool_size
+        self.session = None
+        self.closed = False
+        self.lock = threading.Lock()
+
+    def open(self):
+        with self.lock:
+            self.closed = False
+            if self.session is None:
+                self.session = self.new_session()
+
+    def new_session(self):
+        adapter = HTTPAdapter(pool_connections=self.pool_size,
+                              pool_maxsize=self.pool_size)
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers.update({'Connection': 'keep-alive'})
+        LOGGER.debug('HTTP session opened, timeouts = {}'.format(self.timeout))
+        return session
+
+    def set_timeouts(self, connect_timeout, read_timeout):
+        self.timeout = (connect_timeout, read_timeout)
+
+    def get(self, url):
+        with self.lock:
+            if self.closed:
+                raise requests.exceptions.ConnectionError('HTTP session is closed')
+            if self.session is None:
+                self.session = self.new_session()
+            session = self.session
+        return session.get(url, timeout=self.timeout)
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            if self.session is not None:
+                self.session.close()
+                self.session = None
+                LOGGER.debug('HTTP session closed')
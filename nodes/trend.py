@@ -16,3 +16,17 @@ def get_trend(trend):
         return 6
 
     return 1
+
+
+# Describe a 3 hour pressure change (inHg) the same way the NoaaExt
+# payload does.
+def trend_string(change):
+    if change >= 0.06:
+        return 'Rising Rapidly'
+    if change >= 0.02:
+        return 'Rising Slowly'
+    if change <= -0.06:
+        return 'Falling Rapidly'
+    if change <= -0.02:
+        return 'Falling Slowly'
+    return 'Steady'
@@ -1,92 +1,130 @@
 #
-#  Unit of Measure configuration function
+#  Unit of Measure configuration
 #
-#  Return a dictionary with driver names as the key and the UOM for
-#  the requested unit configuration.
+#  The WeatherLink payload has every value in US units.  QUANTITIES
+#  describes, for each kind of value, how to convert the US value for
+#  each unit system along with the precision and ISY UOM to use.
 #
 #  valid unit configurations are:
-#   metric, imperial, si (same as metric), us (same as imperial), uk
+#   us (same as imperial)  - F, inHg, in, mph
+#   metric                 - C, mb, mm, kph
+#   si                     - C, hPa, mm, m/s
+#   uk                     - C, mb, mm, mph
 #
-#  Ideally, there should be no conflicts between forecast and current
-#  condition driver types
+#  The driver tables built from these (see schema.py) are cached, so
+#  they are only built once for each unit configuration and must not be
+#  modified.
 
+from nodes import trend
 
-def get_uom(units):
+SYSTEMS = ('us', 'metric', 'si', 'uk')
+
+
+def unit_system(units):
     unit_cfg = units.lower()
+    if unit_cfg == 'si':
+        return 'si'
+    if unit_cfg == 'uk':
+        return 'uk'
+    if unit_cfg == 'metric' or unit_cfg.startswith('m'):
+        return 'metric'
+    return 'us'
+
+
+def to_float(value):
+    return float(value)
+
+def f2c(value):
+    return (float(value) - 32.0) * 5.0 / 9.0
+
+def inhg2mb(value):
+    return float(value) * 33.8639
+
+def in2mm(value):
+    return float(value) * 25.4
 
-    if unit_cfg == 'metric' or unit_cfg == 'si' or unit_cfg.startswith('m'):
-        uom = {
-            'ST': 2,   # node server status
-            'CLITEMP': 4,   # temperature
-            'CLIHUM': 22,   # humidity
-            'BARPRES': 117, # pressure
-            'WINDDIR': 76,  # direction
-            'DEWPT': 4,     # dew point
-            'SOLRAD': 74,   # solar radiation
-            'RAINRT': 46,   # rain rate
-            'SPEED': 32,    # wind speed
-            'DISTANC': 83,  # visibility (kilometers)
-            'UV': 71,       # UV index
-            'GV0': 4,       # max temp
-            'GV1': 4,       # min temp
-            'GV2': 4,       # max dewpoint
-            'GV3': 4,       # min dewpoint
-            'GV4': 4,       # heat index
-            'GV5': 4,       # windchill
-            'GV6': 82,      # n/a 
-            'GV7': 49,      # n/a 
-            'GV8': 22,      # humidity high
-            'GV9': 22,      # humidity low
-            'GV10': 117,    # pressure high
-            'GV11': 117,    # pressure low
-            'GV12': 82,     # rain
-            'GV13': 32,     # gusts
-            'GV14': 22,     # N/A
-            'GV15': 82,     # N/A
-            'GV16': 25,     # pressure trend
-            'GV17': 56,     # N/A
-            'GV18': 22,     # N/A
-            'GV19': 25,     # N/A
-            'GV20': 106,    # ETo
-        }
-    else:
-        uom = {
-            'ST': 2,   # node server status
-            'CLITEMP': 17,  # temperature
-            'CLIHUM': 22,   # humidity
-            'BARPRES': 23,  # pressure
-            'WINDDIR': 76,  # direction
-            'DEWPT': 17,    # dew point
-            'SOLRAD': 74,   # solar radiation
-            'RAINRT': 24,   # rain rate
-            'SPEED': 48,    # wind speed
-            'DISTANC': 116, # visibility
-            'UV': 71,       # UV index
-            'GV0': 17,      # max temp
-            'GV1': 17,      # min temp
-            'GV2': 17,      # max dewpoint
-            'GV3': 17,      # min dewpoint
-            'GV4': 17,      # heat index
-            'GV5': 17,      # windchill
-            'GV6': 105,     # N/A
-            'GV7': 48,      # N/A
-            'GV8': 22,      # min humidity
-            'GV9': 22,      # max humidity
-            'GV10': 23,     # min pressure
-            'GV11': 23,     # max pressure
-            'GV12': 105,    # precipitation
-            'GV13': 48,     # gust
-            'GV14': 22,     # N/A
-            'GV15': 105,    # N/A
-            'GV16': 25,     # pressure trend
-            'GV17': 56,     # N/A
-            'GV18': 22,     # N/A
-            'GV19': 25,     # N/A
-            'GV20': 120,    # ETo
-        }
-
-    return uom
+def mph2kph(value):
+    return float(value) * 1.609344
+
+def mph2ms(value):
+    return float(value) * 0.44704
 
 # convert knots to KPH
 def kt2kph(kt):
     return kt * 1.852
+
+
+# quantity : {system : (converter, precision, uom)}
+QUANTITIES = {
+    'status': {
+        'us': (to_float, 0, 25),
+        },
+    'temperature': {
+        'us': (to_float, 1, 17),
+        'metric': (f2c, 1, 4),
+        },
+    'humidity': {
+        'us': (to_float, 0, 22),
+        },
+    'pressure': {
+        'us': (to_float, 3, 23),
+        'metric': (inhg2mb, 1, 117),
+        },
+    'rain': {
+        'us': (to_float, 3, 105),
+        'metric': (in2mm, 1, 82),
+        },
+    'rain_rate': {
+        'us': (to_float, 3, 24),
+        'metric': (in2mm, 1, 46),
+        },
+    'speed': {
+        'us': (to_float, 1, 48),
+        'metric': (mph2kph, 1, 32),
+        'si': (mph2ms, 1, 40),
+        'uk': (to_float, 1, 48),
+        },
+    'direction': {
+        'us': (to_float, 0, 76),
+        },
+    'solar': {
+        'us': (to_float, 0, 74),
+        },
+    'uv': {
+        'us': (to_float, 1, 71),
+        },
+    'et': {
+        'us': (to_float, 3, 120),
+        'metric': (in2mm, 2, 106),
+        },
+    'trend': {
+        'us': (trend.get_trend, 0, 25),
+        },
+    'seconds': {
+        'us': (to_float, 0, 58),
+        },
+    'milliseconds': {
+        'us': (to_float, 1, 42),
+        },
+    'percent': {
+        'us': (to_float, 1, 51),
+        },
+    'count': {
+        'us': (to_float, 0, 56),
+        },
+    }
+
+
+"""
+    Return (converter, precision, uom) for a quantity.  Systems that
+    don't list a quantity use the metric entry (for si and uk) and then
+    the us entry.
+"""
+def conversion(quantity, system):
+    entry = QUANTITIES[quantity]
+    if system in entry:
+        return entry[system]
+    if system != 'us' and 'metric' in entry:
+        return entry['metric']
+    return entry['us']
+
@@ -0,0 +1,204 @@
+#
+#  WeatherLink v2 API client.
+#
+#  Every v2 request is signed: the parameters (api-key, t and any path
+#  parameters such as station-id) are sorted by name, concatenated as
+#  name followed by value and signed with HMAC-SHA256 using the API
+#  secret.
+#
+#  All the stations (and their sensors) available to the API key are
+#  discovered with one /stations and one /sensors request when the node
+#  server starts.  Stations without a station id can't be queried and
+#  are skipped.  After that each poll needs one /current request per
+#  station, made concurrently by the controller over the pooled HTTP
+#  session.
+#
+#  The current conditions come back as a list of sensor blocks, each
+#  with the sensor's data records.  The fields used are copied from the
+#  blocks into the decoded NoaaExt payload layout (US units, floats) so
+#  the rest of the node server handles them the same as v1 data.  The
+#  field names differ between device types, so each payload key lists
+#  the v2 names it can come from.
+
+import hmac
+import hashlib
+import time
+from urllib.parse import urlencode
+import polyinterface
+from nodes import decode
+from nodes import wll
+from nodes import extremes
+
+LOGGER = polyinterface.LOGGER
+
+API_V2_URL = 'https://api.weatherlink.com/v2/'
+
+SECTION = decode.SECTION
+
+# (section, payload key) : v2 field names, first one found wins
+FIELDS = {
+        (None, 'temp_f'): ('temp', 'temp_out'),
+        (None, 'relative_humidity'): ('hum', 'hum_out'),
+        (None, 'dewpoint_f'): ('dew_point',),
+        (None, 'heat_index_f'): ('heat_index',),
+        (None, 'windchill_f'): ('wind_chill',),
+        (None, 'wind_mph'): ('wind_speed_last', 'wind_speed'),
+        (None, 'wind_degrees'): ('wind_dir_last', 'wind_dir'),
+        (None, 'pressure_in'): ('bar_sea_level', 'bar'),
+        (SECTION, 'wind_ten_min_gust_mph'): ('wind_speed_hi_last_10_min', 'wind_gust_10_min'),
+        (SECTION, 'solar_radiation'): ('solar_rad',),
+        (SECTION, 'uv_index'): ('uv_index', 'uv'),
+        (SECTION, 'rain_rate_in_per_hr'): ('rain_rate_last_in', 'rain_rate_in'),
+        (SECTION, 'rain_day_in'): ('rainfall_daily_in', 'rain_day_in'),
+        (SECTION, 'rain_month_in'): ('rainfall_monthly_in', 'rain_month_in'),
+        (SECTION, 'rain_year_in'): ('rainfall_year_in', 'rain_year_in'),
+        }
+
+# Consoles report the trend as a code instead of the change in inHg
+TREND_CODES = {
+        -60: 'Falling Rapidly',
+        -20: 'Falling Slowly',
+        0: 'Steady',
+        20: 'Rising Slowly',
+        60: 'Rising Rapidly',
+        }
+
+
+def signature(secret, params):
+    message = ''.join(name + str(params[name]) for name in sorted(params))
+    return hmac.new(secret.encode('utf-8'), message.encode('utf-8'), hashlib.sha256).hexdigest()
+
+
+def trend_string(value):
+    value = float(value)
+    if abs(value) >= 1:
+        return TREND_CODES.get(int(value), 'Steady')
+    return wll.trend_string(value)
+
+
+"""
+    Convert a /current response to the decoded NoaaExt payload layout.
+    sensors is the list of lsids to use, None to use all of them, zone
+    the station's time zone.
+"""
+def to_payload(current, sensors=None, now=None, zone=None):
+    if now is None:
+        now = time.time()
+
+    records = []
+    for block in current.get('sensors') or []:
+        if sensors is not None and block.get('lsid') not in sensors:
+            continue
+        records.extend(block.get('data') or [])
+
+    payload = {SECTION: {}}
+    for (section, key) in FIELDS:
+        for record in records:
+            value = None
+            for name in FIELDS[(section, key)]:
+                value = record.get(name)
+                if value is not None:
+                    break
+            if value is None:
+                continue
+            try:
+                target = payload if section is None else payload[SECTION]
+                target[key] = float(value)
+                break
+            except (TypeError, ValueError):
+                continue
+
+    ts = None
+    for record in records:
+        if ts is None or (record.get('ts') or 0) > ts:
+            ts = record.get('ts')
+        if 'pressure_tendency_string' not in payload[SECTION] and record.get('bar_trend') is not None:
+            try:
+                payload[SECTION]['pressure_tendency_string'] = trend_string(record['bar_trend'])
+            except (TypeError, ValueError):
+                pass
+
+    if ts is None:
+        ts = current.get('generated_at')
+    if ts is not None:
+        payload['observation_time_rfc822'] = extremes.observation_time(ts, zone)
+        payload[SECTION]['observation_age'] = max(0.0, now - ts)
+    payload[SECTION]['DID'] = str(current.get('station_id', ''))
+
+    return payload
+
+
+class Client:
+    def __init__(self, key, secret, transport, base=API_V2_URL):
+        self.key = key
+        self.secret = secret
+        self.transport = transport
+        self.base = base
+        # discovered stations, ordered by station id
+        self.stations = []
+        # station id : list of active sensor lsids
+        self.sensors = {}
+
+    def url(self, endpoint, path_param=None, now=None):
+        if now is None:
+            now = time.time()
+        params = {'api-key': self.key, 't': int(now)}
+        signed = dict(params)
+        url = self.base + endpoint
+        if path_param is not None:
+            (name, value) = path_param
+            signed[name] = value
+            url += '/' + str(value)
+        params['api-signature'] = signature(self.secret, signed)
+        return url + '?' + urlencode(params)
+
+    def request(self, endpoint, path_param=None):
+        c = self.transport.get(self.url(endpoint, path_param))
+        body = c.content
+        c.close()
+        c.raise_for_status()
+        return decode.loads(body)
+
+    """
+        Find all the stations and sensors available to the API key.
+    """
+    def discover(self):
+        stations = []
+        for station in self.request('stations').get('stations') or []:
+            try:
+                station['station_id'] = int(station.get('station_id'))
+            except (TypeError, ValueError):
+                LOGGER.warning('WeatherLink v2 station {} has no station id, skipping'.format(
+                    station.get('station_name')))
+                continue
+            stations.append(station)
+        self.stations = sorted(stations, key=lambda s: s['station_id'])
+
+        self.sensors = {}
+        for sensor in self.request('sensors').get('sensors') or []:
+            if not sensor.get('active', True):
+                continue
+            self.sensors.setdefault(sensor.get('station_id'), []).append(sensor.get('lsid'))
+
+        LOGGER.info('WeatherLink v2: found {} station(s), {} sensor(s)'.format(
+            len(self.stations), sum(len(s) for s in self.sensors.values())))
+
+    def station(self, station_id):
+        for station in self.stations:
+            if station.get('station_id') == station_id:
+                return station
+        return {}
+
+    def station_name(self, station_id):
+        return self.station(station_id).get('station_name')
+
+    # The station's tzinfo, from its time_zone, or None
+    def station_zone(self, station_id):
+        return extremes.station_zone(self.station(station_id).get('time_zone'))
+
+    def current(self, station_id):
+        return self.request('current', ('station-id', station_id))
+
+    def payload(self, station_id, zone=None):
+        return decode.from_payload(to_payload(self.current(station_id),
+            self.sensors.get(station_id), zone=zone))
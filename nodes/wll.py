@@ -0,0 +1,252 @@
+#
+#  WeatherLink Live local API.
+#
+#  A WeatherLink Live hub serves its current conditions on the LAN
+#  (/v1/current_conditions) and, after a /v1/real_time request, broadcasts
+#  wind and rain as UDP packets every 2.5 seconds for the requested
+#  duration.  Broadcast keeps the real-time session renewed and hands
+#  each packet to a callback from its own socket thread.
+#
+#  The hub's values are converted to the same payload layout the decoder
+#  produces for NoaaExt.json (US units, floats) so the rest of the node
+#  server handles both the same way.  The hub doesn't report day, month
+#  and year extremes other than rain, those come from the local extremes.
+
+import socket
+import threading
+import time
+import polyinterface
+from nodes import decode
+from nodes import trend
+from nodes import extremes
+
+LOGGER = polyinterface.LOGGER
+
+SECTION = decode.SECTION
+
+BROADCAST_PORT = 22222
+# seconds of real-time broadcast to request, and how long before it runs
+# out to renew it
+REALTIME_DURATION = 1200
+RENEW_MARGIN = 60
+# seconds to wait before retrying a failed real-time request
+RETRY_DELAY = 30
+RECEIVE_TIMEOUT = 1.0
+PACKET_SIZE = 4096
+
+# data_structure_type values
+ISS = 1
+BAROMETER = 3
+
+# inches per count for each rain_size
+RAIN_SIZES = {1: 0.01, 2: 0.2 / 25.4, 3: 0.1 / 25.4, 4: 0.001}
+
+# hub key : (section, payload key)
+ISS_FIELDS = {
+        'temp': (None, 'temp_f'),
+        'hum': (None, 'relative_humidity'),
+        'dew_point': (None, 'dewpoint_f'),
+        'heat_index': (None, 'heat_index_f'),
+        'wind_chill': (None, 'windchill_f'),
+        'wind_speed_last': (None, 'wind_mph'),
+        'wind_dir_last': (None, 'wind_degrees'),
+        'wind_speed_hi_last_10_min': (SECTION, 'wind_ten_min_gust_mph'),
+        'solar_rad': (SECTION, 'solar_radiation'),
+        'uv_index': (SECTION, 'uv_index'),
+        }
+
+# Rain values are counts of the rain collector size
+RAIN_FIELDS = {
+        'rain_rate_last': (SECTION, 'rain_rate_in_per_hr'),
+        'rainfall_daily': (SECTION, 'rain_day_in'),
+        'rainfall_monthly': (SECTION, 'rain_month_in'),
+        'rainfall_year': (SECTION, 'rain_year_in'),
+        }
+
+BAROMETER_FIELDS = {
+        'bar_sea_level': (None, 'pressure_in'),
+        }
+
+
+# The hub reports the 3 hour pressure change (inHg), use the same
+# descriptions as the NoaaExt payload.
+trend_string = trend.trend_string
+
+
+def copy_fields(record, fields, payload, scale=1):
+    for key in fields:
+        value = record.get(key)
+        if value is None:
+            continue
+        (section, name) = fields[key]
+        target = payload if section is None else payload[SECTION]
+        # with more than one transmitter, the first one reporting wins
+        if name not in target:
+            try:
+                target[name] = float(value) * scale
+            except (TypeError, ValueError):
+                continue
+
+
+"""
+    Convert the hub's current conditions (or a real-time packet) to the
+    decoded NoaaExt payload layout.  data is the object with the did, ts
+    and conditions keys, zone the station's time zone.
+"""
+def to_payload(data, now=None, zone=None):
+    if now is None:
+        now = time.time()
+
+    payload = {SECTION: {}}
+    ts = data.get('ts')
+    if ts is not None:
+        payload['observation_time_rfc822'] = extremes.observation_time(ts, zone)
+        payload[SECTION]['observation_age'] = max(0.0, now - ts)
+    if data.get('did') is not None:
+        payload[SECTION]['DID'] = data['did']
+
+    for record in data.get('conditions') or []:
+        kind = record.get('data_structure_type')
+        if kind == ISS:
+            copy_fields(record, ISS_FIELDS, payload)
+            size = RAIN_SIZES.get(record.get('rain_size'))
+            if size is not None:
+                copy_fields(record, RAIN_FIELDS, payload, size)
+        elif kind == BAROMETER:
+            copy_fields(record, BAROMETER_FIELDS, payload)
+            if record.get('bar_trend') is not None:
+                payload[SECTION]['pressure_tendency_string'] = trend_string(float(record['bar_trend']))
+
+    return payload
+
+
+# Update an observation with newer values, i.e. from a real-time packet.
+def merge(obs, newer):
+    if obs is None:
+        return newer
+    return obs.merge(newer)
+
+
+class LiveClient:
+    def __init__(self, address, transport):
+        self.address = address
+        self.host = address.split(':')[0]
+        self.base = 'http://{}/v1/'.format(address)
+        self.transport = transport
+        self.did = None
+
+    def request(self, path):
+        c = self.transport.get(self.base + path)
+        body = c.content
+        c.close()
+        c.raise_for_status()
+        data = decode.loads(body)
+        if data.get('error') is not None:
+            raise ValueError('WeatherLink Live error: ' + str(data['error']))
+        return data['data']
+
+    def current_conditions(self):
+        data = self.request('current_conditions')
+        self.did = data.get('did')
+        return data
+
+    def payload(self, zone=None):
+        return decode.from_payload(to_payload(self.current_conditions(), zone=zone))
+
+    # Start (or renew) the real-time broadcast, returns (port, duration)
+    def start_realtime(self, duration=REALTIME_DURATION):
+        data = self.request('real_time?duration={}'.format(int(duration)))
+        return (data.get('broadcast_port', BROADCAST_PORT), data.get('duration', duration))
+
+
+"""
+    Listen for the hub's real-time UDP broadcasts.  The broadcast is
+    requested before the socket is opened (the reply has the port to
+    use) and renewed RENEW_MARGIN seconds before it expires.
+"""
+class Broadcast:
+    def __init__(self, client, callback, duration=REALTIME_DURATION):
+        self.client = client
+        self.callback = callback
+        self.duration = duration
+        self.port = None
+        self.renew_at = 0
+        self.packets = 0
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name='WeatherLinkLive')
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(timeout)
+            self.thread = None
+
+    def renew(self):
+        try:
+            (port, duration) = self.client.start_realtime(self.duration)
+            if self.port is not None and port != self.port:
+                LOGGER.warning('Real-time broadcast moved to port {}, still listening on {}'.format(port, self.port))
+            else:
+                self.port = port
+            self.renew_at = time.time() + max(duration - RENEW_MARGIN, RETRY_DELAY)
+            LOGGER.debug('Real-time broadcast renewed for {} seconds'.format(duration))
+        except Exception as e:
+            LOGGER.error('Real-time broadcast request failed: ' + str(e))
+            self.renew_at = time.time() + RETRY_DELAY
+
+    def open(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(('', self.port))
+        sock.settimeout(RECEIVE_TIMEOUT)
+        return sock
+
+    def run(self):
+        while self.running and self.port is None:
+            self.renew()
+            # wait RETRY_DELAY before asking again, checking for stop
+            while self.running and self.port is None and time.time() < self.renew_at:
+                time.sleep(min(RECEIVE_TIMEOUT, max(0, self.renew_at - time.time())))
+
+        if not self.running:
+            return
+
+        try:
+            sock = self.open()
+        except OSError as e:
+            LOGGER.error('Failed to listen for real-time broadcasts on port {}: {}'.format(self.port, str(e)))
+            return
+
+        LOGGER.info('Listening for real-time broadcasts on port {}'.format(self.port))
+        try:
+            while self.running:
+                if time.time() >= self.renew_at:
+                    self.renew()
+                try:
+                    (data, sender) = sock.recvfrom(PACKET_SIZE)
+                except socket.timeout:
+                    continue
+
+                try:
+                    packet = decode.loads(data)
+                except ValueError:
+                    LOGGER.debug('Ignoring invalid real-time packet from {}'.format(sender[0]))
+                    continue
+                # ignore other hubs on the network
+                if self.client.did is not None and packet.get('did') != self.client.did:
+                    continue
+
+                self.packets += 1
+                try:
+                    self.callback(packet)
+                except Exception as e:
+                    LOGGER.error('Real-time update failed: ' + str(e))
+        finally:
+            sock.close()
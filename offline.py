@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Run the node server without Polyglot.
+Copyright (c) 2020 Robert Paauwe
+
+OfflineInterface stands in for polyinterface.Interface.  Messages that
+would be sent to Polyglot over MQTT are counted (and optionally kept)
+instead, so the controller and its nodes can be driven by the benchmark
+and other tools without a Polyglot server or ISY.
+"""
+import queue
+import polyinterface
+from nodes import davis
+
+
+class OfflineInterface:
+    def __init__(self, params=None, level=30, keep=False):
+        self.config = {
+                'customParams': dict(params or {}),
+                'customData': {'level': level},
+                'notices': {},
+                'nodes': [],
+                'isyVersion': '5.0.16',
+                }
+        self.inQueue = queue.Queue()
+        self.keep = keep
+        self.sent = []
+        self.messages = 0
+        self.status = 0
+
+    def onConfig(self, callback):
+        pass
+
+    def onStop(self, callback):
+        pass
+
+    def send(self, message):
+        self.messages += 1
+        if 'status' in message:
+            self.status += 1
+        if self.keep:
+            self.sent.append(message)
+
+    def addNode(self, node):
+        self.send({'addnode': {'nodes': [{'address': node.address}]}})
+
+    def delNode(self, address):
+        self.send({'removenode': {'address': address}})
+
+    def saveCustomData(self, data):
+        self.config['customData'] = data
+
+    def saveCustomParams(self, data):
+        self.config['customParams'] = data
+
+    def addNotice(self, data):
+        self.send({'addnotice': data})
+
+    def removeNotice(self, data):
+        self.send({'removenotice': data})
+
+    def installprofile(self):
+        self.send({'installprofile': {'reboot': False}})
+
+    def restart(self):
+        self.send({'restart': {}})
+
+    def reset(self):
+        self.sent = []
+        self.messages = 0
+        self.status = 0
+
+
+"""
+    Create a controller connected to an OfflineInterface and start it.
+    Unless background is True the fetch pipeline is stopped so that
+    the caller drives polls with get_data().
+    Returns (controller, interface).
+"""
+def start_controller(params, level=30, keep=False, background=False):
+    # polyinterface redirects stdout/stderr to its log when imported
+    # by a script, put them back for the tools.
+    polyinterface.unload_interface()
+    polyinterface.LOGGER.setLevel(level)
+
+    iface = OfflineInterface(params, level, keep)
+    control = davis.Controller(iface)
+    control.polyConfig = iface.config
+    # there's no ISY to flood, don't pace the driver updates
+    control.publisher.rate = 0
+    control.start()
+    if not background:
+        control.pipeline.stop()
+    return (control, iface)
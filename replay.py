@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Replay captured WeatherLink responses through the node server.
+Copyright (c) 2020 Robert Paauwe
+
+Reads a capture made with the 'Capture File' parameter and feeds each
+response to a controller running on an OfflineInterface, the same way
+a poll would: StationStatus.json responses update the station metadata
+and NoaaExt.json responses are decoded and published to the nodes.
+Nothing is requested from the WeatherLink server.
+
+    python3 replay.py capture.jsonl.gz
+    python3 replay.py capture.jsonl.gz --speed 1      # real-time pace
+    python3 replay.py capture.jsonl.gz --profile      # profile parsing
+
+The controller runs in a scratch directory (--workdir) so the replay
+doesn't change the extremes, metadata or snapshot files of the node
+server.
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import cProfile
+import pstats
+import polyinterface
+import offline
+from nodes import capture
+from nodes import decode
+
+
+"""
+    Return the stations in the order they first appear in the capture,
+    the first one is the primary station.
+"""
+def capture_stations(path):
+    stations = []
+    for entry in capture.read(path):
+        if entry.get('station') not in stations:
+            stations.append(entry.get('station'))
+    return stations
+
+
+def replay(control, iface, path, speed=0, out=None):
+    if out is None:
+        out = sys.stdout
+    stations = dict((st.device_id, st) for st in control.stations)
+    counts = {'records': 0, 'observations': 0, 'repeated': 0, 'errors': 0, 'skipped': 0}
+    first = None
+    started = time.perf_counter()
+    parse_time = 0.0
+
+    for entry in capture.read(path):
+        counts['records'] += 1
+        st = stations.get(entry.get('station'))
+        if st is None:
+            counts['skipped'] += 1
+            continue
+
+        ts = entry.get('t', 0)
+        if speed > 0:
+            if first is None:
+                first = (ts, time.perf_counter())
+            delay = (ts - first[0]) / speed - (time.perf_counter() - first[1])
+            if delay > 0:
+                time.sleep(delay)
+
+        if entry.get('status') != 200:
+            counts['errors'] += 1
+            continue
+
+        start = time.perf_counter()
+        try:
+            if entry.get('source') == 'StationStatus.json':
+                st.metadata.update(decode.loads(entry['body']), ts)
+                control.apply_metadata(st)
+            else:
+                obs = control.decode(entry['body'])
+                if st.schedule.is_new(obs, ts):
+                    counts['observations'] += 1
+                    control.process_station(st, obs, ts)
+                else:
+                    counts['repeated'] += 1
+        except Exception as e:
+            counts['errors'] += 1
+            out.write('{:.3f} {} {}: {}\n'.format(ts, entry.get('station'), entry.get('source'), str(e)))
+        parse_time += time.perf_counter() - start
+
+    elapsed = time.perf_counter() - started
+    out.write('{records} records, {observations} new observations, {repeated} repeated, '
+            '{errors} errors, {skipped} skipped\n'.format(**counts))
+    out.write('{} driver updates sent\n'.format(iface.status))
+    if counts['records'] > 0:
+        out.write('{:.3f} seconds, {:.3f} ms parsing per record\n'.format(
+            elapsed, parse_time * 1000.0 / counts['records']))
+    return counts
+
+
+def main(argv):
+    # polyinterface sends stdout and stderr to its log when it's
+    # imported, put them back before anything is printed.
+    polyinterface.unload_interface()
+
+    parser = argparse.ArgumentParser(description='Replay captured WeatherLink responses')
+    parser.add_argument('capture', help='capture file (rotated files are read first)')
+    parser.add_argument('--speed', type=float, default=0,
+            help='replay speed, 1 for real-time pace, 0 (default) for as fast as possible')
+    parser.add_argument('--units', default='us')
+    parser.add_argument('--level', type=int, default=30, help='log level')
+    parser.add_argument('--workdir', help='directory for the node server files (created if needed), default a temporary one')
+    parser.add_argument('--profile', action='store_true', help='profile the replay')
+    args = parser.parse_args(argv)
+
+    path = os.path.abspath(args.capture)
+    stations = capture_stations(path)
+    if len(stations) == 0:
+        print('No records in ' + path)
+        return 1
+
+    workdir = args.workdir
+    if workdir is None:
+        workdir = tempfile.mkdtemp(prefix='weatherlink-replay-')
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+
+    params = {
+            'Device ID': stations[0],
+            'Password': 'replay',
+            'API Token': 'replay',
+            'Stations': ';'.join('{}:replay:replay'.format(s) for s in stations[1:]),
+            'Units': args.units,
+            # nothing should be requested, make sure it fails right away
+            'API URL': 'http://127.0.0.1:9/v1/',
+            }
+    (control, iface) = offline.start_controller(params, args.level)
+    iface.reset()
+
+    if args.profile:
+        profile = cProfile.Profile()
+        profile.enable()
+    replay(control, iface, path, args.speed)
+    if args.profile:
+        profile.disable()
+        pstats.Stats(profile).sort_stats('cumulative').print_stats(25)
+
+    control.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the WeatherLink v1 API.
+Copyright (c) 2020 Robert Paauwe
+
+Serves the sample NoaaExt.json and StationStatus.json payloads from
+api_notes.txt (or payloads recorded to a file) so the node server can be
+run and benchmarked without the real API.  Latency, errors and truncated
+responses can be injected.
+
+    python3 standin.py --port 8080 --latency 0.2 --errors 0.1
+
+Then set the 'API URL' parameter to http://localhost:8080/v1/
+
+It also stands in for a WeatherLink Live hub.  /v1/current_conditions
+serves the sample observation in the hub's format and /v1/real_time
+starts UDP broadcasts of wind and rain, like the hub, to --udp-host.
+Set the 'WLL Address' parameter to localhost:8080 to use it.
+
+The v2 API is served under /v2/ (stations, sensors and current) for one
+station with the sample observation.  Set the 'API Key' and 'API Secret'
+parameters to any value to use it, signatures aren't checked.
+"""
+import os
+import sys
+import time
+import json
+import random
+import argparse
+import socket
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from email.utils import formatdate
+
+NOTES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'api_notes.txt')
+
+# Numeric fields (and how much they may vary) that are changed for each
+# synthesized observation.
+JITTER = {
+        'temp_f': 0.5,
+        'dewpoint_f': 0.3,
+        'heat_index_f': 0.5,
+        'windchill_f': 0.5,
+        'pressure_in': 0.004,
+        'relative_humidity': 2,
+        'wind_degrees': 20,
+        'wind_mph': 2,
+        'wind_kt': 1.7,
+        }
+
+
+"""
+    Load the sample payloads from api_notes.txt.  Each sample follows a
+    'Data looks like:' line.  Returns a dictionary with 'NoaaExt.json'
+    and 'StationStatus.json' keys.
+"""
+def load_samples(path=NOTES):
+    with open(path) as f:
+        text = f.read()
+
+    decoder = json.JSONDecoder()
+    samples = {}
+    start = 0
+    while True:
+        start = text.find('Data looks like:', start)
+        if start < 0:
+            break
+        (data, start) = decoder.raw_decode(text, text.find('{', start))
+        if 'davis_current_observation' in data:
+            samples['NoaaExt.json'] = data
+        elif 'station_did' in data:
+            samples['StationStatus.json'] = data
+
+    return samples
+
+
+def number(source, key):
+    try:
+        return float(source[key])
+    except (KeyError, TypeError, ValueError):
+        return 0.0
+
+
+"""
+    Build a WeatherLink Live current conditions 'data' object from a
+    NoaaExt sample.  Rain is reported as counts of 0.01 inches.
+"""
+def live_conditions(sample, now):
+    dco = sample['davis_current_observation']
+    iss = {
+            'lsid': 48308,
+            'data_structure_type': 1,
+            'txid': 1,
+            'temp': number(sample, 'temp_f'),
+            'hum': number(sample, 'relative_humidity'),
+            'dew_point': number(sample, 'dewpoint_f'),
+            'heat_index': number(sample, 'heat_index_f'),
+            'wind_chill': number(sample, 'windchill_f'),
+            'wind_speed_last': number(sample, 'wind_mph'),
+            'wind_dir_last': number(sample, 'wind_degrees'),
+            'wind_speed_hi_last_10_min': number(dco, 'wind_ten_min_gust_mph'),
+            'solar_rad': number(dco, 'solar_radiation'),
+            'uv_index': number(dco, 'uv_index'),
+            'rain_size': 1,
+            'rain_rate_last': round(number(dco, 'rain_rate_in_per_hr') * 100),
+            'rainfall_daily': round(number(dco, 'rain_day_in') * 100),
+            'rainfall_monthly': round(number(dco, 'rain_month_in') * 100),
+            'rainfall_year': round(number(dco, 'rain_year_in') * 100),
+            }
+    barometer = {
+            'lsid': 48306,
+            'data_structure_type': 3,
+            'bar_sea_level': number(sample, 'pressure_in'),
+            'bar_trend': 0.03,
+            'bar_absolute': number(sample, 'pressure_in') - 0.1,
+            }
+    return {'did': dco['DID'], 'ts': int(now), 'conditions': [iss, barometer]}
+
+
+# The part of the current conditions sent in a real-time broadcast
+REALTIME_KEYS = ('lsid', 'data_structure_type', 'txid', 'wind_speed_last',
+        'wind_dir_last', 'rain_size', 'rain_rate_last', 'rainfall_daily',
+        'rainfall_monthly', 'rainfall_year', 'wind_speed_hi_last_10_min')
+
+V2_STATION = 1001
+
+def v2_response(path, sample, now):
+    if path.startswith('stations'):
+        return {'stations': [{'station_id': V2_STATION,
+            'station_name': sample.get('station_name', 'Stand-in')}]}
+    if path.startswith('sensors'):
+        return {'sensors': [{'lsid': c['lsid'], 'station_id': V2_STATION, 'active': True}
+            for c in live_conditions(sample, now)['conditions']]}
+    if path.startswith('current/'):
+        conditions = live_conditions(sample, now)
+        sensors = []
+        for c in conditions['conditions']:
+            record = dict(c)
+            record['ts'] = conditions['ts']
+            if 'rain_size' in record:
+                for key in ('rain_rate_last', 'rainfall_daily', 'rainfall_monthly', 'rainfall_year'):
+                    record[key + '_in'] = record.pop(key) / 100.0
+            sensors.append({'lsid': c['lsid'], 'data': [record]})
+        return {'station_id': V2_STATION, 'generated_at': int(now), 'sensors': sensors}
+    return None
+
+
+def realtime_packet(conditions, now):
+    iss = conditions['conditions'][0]
+    record = {}
+    for key in REALTIME_KEYS:
+        record[key] = iss[key]
+    record['wind_speed_last'] = max(0.0, record['wind_speed_last'] + random.uniform(-2, 2))
+    record['wind_dir_last'] = (record['wind_dir_last'] + random.uniform(-20, 20)) % 360
+    return {'did': conditions['did'], 'ts': int(now), 'conditions': [record]}
+
+
+def synthesize(sample, now):
+    data = json.loads(json.dumps(sample))
+    for key in JITTER:
+        if key in data:
+            value = float(data[key]) + random.uniform(-JITTER[key], JITTER[key])
+            data[key] = '{:.3f}'.format(value)
+    data['observation_time_rfc822'] = formatdate(now, localtime=True)
+    data['davis_current_observation']['observation_age'] = 0
+    return data
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        server = self.server
+        server.count_request()
+
+        delay = server.latency
+        if server.jitter > 0:
+            delay += random.uniform(0, server.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+        path = self.path.split('?')[0]
+        if '/v2/' in path:
+            body = v2_response(path.split('/v2/')[1],
+                    json.loads(server.payload('NoaaExt.json')), time.time())
+            if body is None:
+                self.reply(404, b'{"error":"not found"}')
+            else:
+                self.reply(200, json.dumps(body).encode('utf-8'))
+            return
+
+        name = path.split('/')[-1]
+        if name == 'real_time':
+            duration = 1200
+            for arg in self.path.partition('?')[2].split('&'):
+                if arg.startswith('duration='):
+                    duration = int(arg[len('duration='):])
+            server.start_broadcast(duration)
+            self.reply(200, json.dumps({'data': {'broadcast_port': server.udp_port,
+                'duration': duration}, 'error': None}).encode('utf-8'))
+            return
+        if name == 'current_conditions':
+            body = {'data': live_conditions(json.loads(server.payload('NoaaExt.json')), time.time()),
+                    'error': None}
+            self.reply(200, json.dumps(body).encode('utf-8'))
+            return
+
+        if name not in server.payloads:
+            self.reply(404, b'{"error":"not found"}')
+            return
+
+        if random.random() < server.errors:
+            self.reply(503, b'{"error":"service unavailable"}')
+            return
+
+        body = server.payload(name)
+        if random.random() < server.truncate:
+            # Claim the full length but only send part of the body
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body[:len(body) // 2])
+            self.close_connection = True
+            return
+
+        self.reply(200, body)
+
+    def reply(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+"""
+    The stand-in server.
+
+    latency    - seconds to wait before responding
+    jitter     - random extra latency, up to this many seconds
+    errors     - fraction of requests that get a 503 error
+    truncate   - fraction of requests that get a truncated body
+    interval   - seconds between synthesized observations, 0 to serve
+                 the samples unchanged
+    udp_host   - where real-time broadcasts are sent
+    udp_port   - port real-time broadcasts are sent to
+    broadcast_interval - seconds between real-time broadcasts
+"""
+class StandIn(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port=0, payloads=None, latency=0, jitter=0,
+                 errors=0, truncate=0, interval=0, verbose=False,
+                 udp_host='127.0.0.1', udp_port=22222, broadcast_interval=2.5):
+        ThreadingHTTPServer.__init__(self, ('127.0.0.1', port), Handler)
+        if payloads is None:
+            payloads = load_samples()
+        self.payloads = payloads
+        self.latency = latency
+        self.jitter = jitter
+        self.errors = errors
+        self.truncate = truncate
+        self.interval = interval
+        self.verbose = verbose
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.thread = None
+        self.observed = 0
+        self.current = None
+        self.udp_host = udp_host
+        self.udp_port = udp_port
+        self.broadcast_interval = broadcast_interval
+        self.broadcast_until = 0
+        self.broadcaster = None
+        self.broadcasts = 0
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}/v1/'.format(self.server_address[1])
+
+    def count_request(self):
+        with self.lock:
+            self.requests += 1
+
+    def payload(self, name):
+        data = self.payloads[name]
+        if name == 'NoaaExt.json' and self.interval > 0:
+            with self.lock:
+                now = time.time()
+                if self.current is None or now - self.observed >= self.interval:
+                    self.observed = now
+                    self.current = synthesize(data, now)
+                data = self.current
+        return json.dumps(data).encode('utf-8')
+
+    # Start, or extend, the real-time broadcasts
+    def start_broadcast(self, duration):
+        with self.lock:
+            self.broadcast_until = time.time() + duration
+            if self.broadcaster is not None and self.broadcaster.is_alive():
+                return
+            self.broadcaster = threading.Thread(target=self.broadcast, name='StandInUDP')
+            self.broadcaster.daemon = True
+            self.broadcaster.start()
+
+    def broadcast(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        try:
+            while time.time() < self.broadcast_until:
+                now = time.time()
+                conditions = live_conditions(json.loads(self.payload('NoaaExt.json')), now)
+                packet = json.dumps(realtime_packet(conditions, now)).encode('utf-8')
+                sock.sendto(packet, (self.udp_host, self.udp_port))
+                self.broadcasts += 1
+                time.sleep(self.broadcast_interval)
+        finally:
+            sock.close()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, name='StandIn')
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.broadcast_until = 0
+        self.shutdown()
+        self.server_close()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='WeatherLink API stand-in')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--payload', help='NoaaExt.json payload file to serve')
+    parser.add_argument('--latency', type=float, default=0)
+    parser.add_argument('--jitter', type=float, default=0)
+    parser.add_argument('--errors', type=float, default=0)
+    parser.add_argument('--truncate', type=float, default=0)
+    parser.add_argument('--interval', type=float, default=60,
+            help='seconds between synthesized observations, 0 to disable')
+    parser.add_argument('--udp-host', default='127.0.0.1',
+            help='where real-time broadcasts are sent, 255.255.255.255 for the LAN')
+    parser.add_argument('--udp-port', type=int, default=22222)
+    args = parser.parse_args(argv)
+
+    payloads = load_samples()
+    if args.payload:
+        with open(args.payload) as f:
+            payloads['NoaaExt.json'] = json.load(f)
+
+    server = StandIn(args.port, payloads, args.latency, args.jitter,
+            args.errors, args.truncate, args.interval, verbose=True,
+            udp_host=args.udp_host, udp_port=args.udp_port)
+    print('Serving WeatherLink stand-in at ' + server.url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
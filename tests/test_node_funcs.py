@@ -0,0 +1,57 @@
+#
+#  Tests for the driver deadbands in node_funcs.
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import polyinterface
+import node_funcs
+
+# polyinterface sends stdout and stderr to its log when it's imported
+polyinterface.unload_interface()
+
+
+class Node:
+    def __init__(self):
+        self.published = {}
+
+
+class DeadbandTest(unittest.TestCase):
+    def test_one_step_is_published(self):
+        band = node_funcs.DEADBANDS[17]
+        for (last, value) in ((72.1, 72.2), (72.2, 72.3), (70.0, 70.1), (70.1, 70.0)):
+            self.assertFalse(node_funcs.in_deadband(value, last, band), (last, value))
+        band = node_funcs.DEADBANDS[4]
+        self.assertFalse(node_funcs.in_deadband(21.3, 21.2, band))
+        band = node_funcs.DEADBANDS[23]
+        for (last, value) in ((29.921, 29.924), (29.924, 29.927), (30.000, 29.997)):
+            self.assertFalse(node_funcs.in_deadband(value, last, band), (last, value))
+
+    def test_less_than_one_step_is_suppressed(self):
+        band = node_funcs.DEADBANDS[17]
+        for (last, value) in ((72.2, 72.2), (72.2, 72.25), (70.0, 70.09)):
+            self.assertTrue(node_funcs.in_deadband(value, last, band), (last, value))
+        band = node_funcs.DEADBANDS[23]
+        for (last, value) in ((29.921, 29.921), (29.921, 29.923)):
+            self.assertTrue(node_funcs.in_deadband(value, last, band), (last, value))
+
+    def test_wind_direction_wraps(self):
+        band = node_funcs.DEADBANDS[76]
+        self.assertTrue(node_funcs.in_deadband(2, 358, band))
+        self.assertFalse(node_funcs.in_deadband(3, 358, band))
+
+    def test_unchanged_value_without_band_is_suppressed(self):
+        self.assertTrue(node_funcs.in_deadband(5.0, 5.0, node_funcs.NO_DEADBAND))
+        self.assertFalse(node_funcs.in_deadband(5.1, 5.0, node_funcs.NO_DEADBAND))
+
+    def test_should_publish_sequence(self):
+        node = Node()
+        sent = [v for v in (72.1, 72.2, 72.3, 72.3, 72.4) if node_funcs.should_publish(node, 'CLITEMP', v, 17)]
+        self.assertEqual(sent, [72.1, 72.2, 72.3, 72.4])
+
+
+if __name__ == '__main__':
+    unittest.main()